@@ -1,15 +1,27 @@
 from flask import Flask, redirect, url_for
 from config import Config
-from database import init_db
+from database import init_db, init_response_templates
+from archive import start_archiver, reserve_archived_ids
+from search import init_search
+from rate_limit import init_rate_limiter
+from assets import init_assets
+from fragment_cache import init_fragment_cache
+from dialogue_state import init_dialogue_states
 
 app = Flask(__name__) # create the Flask app instance
 app.config.from_object(Config) # load configuration from Config class
 
 # Initialize database
 init_db(app)
+reserve_archived_ids(app) # new records never reuse the id of an archived one
+start_archiver(app) # move old records to cold storage in the background
+init_rate_limiter(app) # token buckets for the chat and insights APIs
+init_assets(app) # fingerprinted, precompressed JS/CSS bundles
+init_fragment_cache(app) # cache limits for the dashboard and profile fragments
+init_dialogue_states(app) # in-memory chat session states
 
 # Import and register blueprints
-from main import main_bp
+from main import main_bp, known_response_texts
 from auth import auth_bp
 from resources import resources_bp
 
@@ -17,6 +29,9 @@ app.register_blueprint(main_bp) # main blueprint
 app.register_blueprint(auth_bp, url_prefix='/auth') # authentication blueprint
 app.register_blueprint(resources_bp, url_prefix='/resources') # resources blueprint
 
+init_response_templates(app, known_response_texts()) # store fixed AI responses as template ids
+init_search(app) # create and fill the full-text search index
+
 @app.route('/') # home route
 def index(): # redirect to logic
     return redirect(url_for('auth.login')) # redirect to login page
@@ -0,0 +1,296 @@
+"""Move old EmotionRecord rows into compressed monthly SQLite partitions and read them back transparently."""
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from database import db, EmotionRecord, EmotionRecordText, ArchivedEmotionStats, canonical_emotion, emotion_name, reserve_record_ids
+from search import forget_records
+
+PARTITION_PATTERN = re.compile(r'^emotions-(\d{4}-\d{2})\.db$') # one cold storage file per month
+BATCH_SIZE = 1000 # records moved per transaction
+
+PARTITION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS emotion_record (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    emotion TEXT NOT NULL,
+    confidence REAL,
+    timestamp TEXT NOT NULL,
+    session_id INTEGER,
+    user_input BLOB,
+    ai_response BLOB,
+    drug_mentions INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_emotion_record_user ON emotion_record (user_id, id);
+"""
+
+# Archived record with the same attributes as EmotionRecord so callers can treat both alike
+class ArchivedRecord:
+    __slots__ = ('id', 'user_id', 'emotion', 'confidence', 'timestamp', 'session_id', 'user_input', 'ai_response', 'drug_mentions')
+
+    def __init__(self, row):
+        self.id, self.user_id, emotion, self.confidence, timestamp, self.session_id, user_input, ai_response, drug_mentions = row
+        self.emotion = canonical_emotion(emotion) # partitions written before emotion codes may hold other spellings
+        self.timestamp = datetime.fromisoformat(timestamp)
+        self.user_input = decompress_text(user_input)
+        self.ai_response = decompress_text(ai_response)
+        self.drug_mentions = bool(drug_mentions)
+
+def compress_text(text):
+    return zlib.compress(text.encode('utf-8')) if text is not None else None
+
+def decompress_text(data):
+    return zlib.decompress(data).decode('utf-8') if data is not None else None
+
+def archive_dir(app):
+    """Absolute path of the cold storage directory."""
+    return os.path.join(app.instance_path, app.config.get('ARCHIVE_DIR', 'archive'))
+
+def partition_path(directory, month):
+    return os.path.join(directory, f'emotions-{month}.db')
+
+def list_partitions(directory):
+    """Return the archived months, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    months = [m.group(1) for m in map(PARTITION_PATTERN.match, os.listdir(directory)) if m]
+    return sorted(months)
+
+def open_partition(directory, month):
+    connection = sqlite3.connect(partition_path(directory, month))
+    connection.executescript(PARTITION_SCHEMA)
+    return connection
+
+def archive_old_records(app, now=None):
+    """Move records older than ARCHIVE_AFTER_DAYS into their monthly partitions. Returns the number moved."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=app.config.get('ARCHIVE_AFTER_DAYS', 90))
+    directory = archive_dir(app)
+    os.makedirs(directory, exist_ok=True)
+    moved = 0
+
+    while True:
+        records = EmotionRecord.query.filter(
+            EmotionRecord.timestamp < cutoff
+        ).order_by(EmotionRecord.id).limit(BATCH_SIZE).all() # oldest records first
+        if not records:
+            break
+
+        by_month = {} # group the batch by target partition
+        for record in records:
+            by_month.setdefault(record.timestamp.strftime('%Y-%m'), []).append(record)
+
+        # Write to cold storage first; INSERT OR REPLACE makes a retried batch harmless
+        for month, month_records in by_month.items():
+            with open_partition(directory, month) as connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO emotion_record VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(r.id, r.user_id, r.emotion, r.confidence, r.timestamp.isoformat(), r.session_id,
+                      compress_text(r.user_input), compress_text(r.ai_response), int(bool(r.drug_mentions)))
+                     for r in month_records]
+                )
+            connection.close()
+
+        # Remove from the hot table and update the rollups in one transaction
+        ids = [r.id for r in records]
+        EmotionRecordText.query.filter(EmotionRecordText.record_id.in_(ids)).delete(synchronize_session=False)
+        deleted = EmotionRecord.query.filter(EmotionRecord.id.in_(ids)).delete(synchronize_session=False)
+        if deleted != len(ids): # another archiver got here first, its rollups already cover these rows
+            db.session.rollback()
+            break
+        for month, month_records in by_month.items():
+            add_to_rollups(month, month_records)
+        db.session.commit()
+        db.session.expunge_all() # the deleted records are still in the identity map
+        moved += len(ids)
+
+    return moved
+
+def add_to_rollups(month, records):
+    totals = {}
+    for record in records:
+        key = (record.user_id, record.emotion_id)
+        count, input_count, input_length_sum, drug_mentions = totals.get(key, (0, 0, 0, 0))
+        totals[key] = (
+            count + 1,
+            input_count + (record.input_length is not None),
+            input_length_sum + (record.input_length or 0),
+            drug_mentions + bool(record.drug_mentions)
+        )
+    for (user_id, emotion_id), (count, input_count, input_length_sum, drug_mentions) in totals.items():
+        stats = ArchivedEmotionStats.query.get((user_id, month, emotion_id))
+        if stats is None:
+            stats = ArchivedEmotionStats(user_id=user_id, month=month, emotion_id=emotion_id, count=0, input_count=0, input_length_sum=0, drug_mentions=0)
+            db.session.add(stats)
+        stats.count += count
+        stats.input_count += input_count
+        stats.input_length_sum += input_length_sum
+        stats.drug_mentions += drug_mentions
+
+def delete_expired_partitions(app, now=None):
+    """Delete whole partitions older than ARCHIVE_RETENTION_MONTHS. Rollups are kept so lifetime totals stay intact."""
+    retention = app.config.get('ARCHIVE_RETENTION_MONTHS', 0)
+    if not retention:
+        return []
+    now = now or datetime.utcnow()
+    index = now.year * 12 + now.month - 1 - retention
+    oldest_kept = f'{index // 12:04d}-{index % 12 + 1:02d}'
+    directory = archive_dir(app)
+    expired = [month for month in list_partitions(directory) if month < oldest_kept]
+    for month in expired:
+        path = partition_path(directory, month)
+        connection = sqlite3.connect(path)
+        try: # exactly the partition's ids, other months' records may interleave with them
+            record_ids = [row[0] for row in connection.execute('SELECT id FROM emotion_record')]
+        finally:
+            connection.close()
+        forget_records(record_ids)
+        db.session.commit()
+        os.remove(path) # dropping a month is a single file delete
+    return expired
+
+def iter_partition(directory, month):
+    """Yield every record of one partition."""
+    connection = sqlite3.connect(partition_path(directory, month))
+    try:
+        for row in connection.execute('SELECT * FROM emotion_record ORDER BY id'):
+            yield ArchivedRecord(row)
+    finally:
+        connection.close()
+
+def archived_months(app, user_id):
+    """Return the months holding records of a user, oldest first, from the rollups instead of opening every partition."""
+    directory = archive_dir(app)
+    months = db.session.query(ArchivedEmotionStats.month).filter_by(user_id=user_id).distinct().order_by(ArchivedEmotionStats.month)
+    return [month for (month,) in months if os.path.exists(partition_path(directory, month))] # expired partitions keep their rollups
+
+def iter_archived(app, user_id, newest_first=True):
+    """Yield a user's archived records from the partitions that hold them."""
+    directory = archive_dir(app)
+    months = archived_months(app, user_id)
+    order = 'DESC' if newest_first else 'ASC'
+    for month in (reversed(months) if newest_first else months):
+        connection = sqlite3.connect(partition_path(directory, month))
+        try:
+            cursor = connection.execute(f'SELECT * FROM emotion_record WHERE user_id = ? ORDER BY id {order}', (user_id,))
+            for row in cursor:
+                yield ArchivedRecord(row)
+        finally:
+            connection.close()
+
+def iter_hot(user_id, newest_first=True, batch_size=500):
+    """Yield a user's hot records in id keyset batches; no cursor stays open while a slow client reads them."""
+    last_id = None
+    while True:
+        query = EmotionRecord.query.filter_by(user_id=user_id)
+        if last_id is not None:
+            query = query.filter(EmotionRecord.id < last_id if newest_first else EmotionRecord.id > last_id)
+        records = query.order_by(EmotionRecord.id.desc() if newest_first else EmotionRecord.id).limit(batch_size).all()
+        if not records:
+            return
+        for record in records:
+            db.session.expunge(record) # keep the loaded values, the text comes along through its cascade
+        db.session.commit() # end the read so writers are not locked out while the batch is consumed
+        yield from records
+        last_id = records[-1].id
+
+def iter_history(app, user_id, newest_first=True, batch_size=500):
+    """Yield a user's records from the hot table and the archive as one stream."""
+    if newest_first: # hot records are always newer than archived ones
+        yield from iter_hot(user_id, newest_first=True, batch_size=batch_size)
+        yield from iter_archived(app, user_id, newest_first=True)
+    else:
+        yield from iter_archived(app, user_id, newest_first=False)
+        yield from iter_hot(user_id, newest_first=False, batch_size=batch_size)
+
+def recent_history(app, user_id, limit):
+    """Return the newest records of a user, only opening archive partitions if the hot table runs out."""
+    records = EmotionRecord.query.filter_by(user_id=user_id).order_by(EmotionRecord.timestamp.desc()).limit(limit).all()
+    if len(records) < limit:
+        for record in iter_archived(app, user_id, newest_first=True):
+            records.append(record)
+            if len(records) >= limit:
+                break
+    return records
+
+def emotion_counts(user_id):
+    """Return {emotion: count} over hot and archived records."""
+    counts = dict(db.session.query(
+        EmotionRecord.emotion_id,
+        db.func.count(EmotionRecord.id)
+    ).filter_by(user_id=user_id).group_by(EmotionRecord.emotion_id).all()) # grouped by the integer code
+    archived = db.session.query(
+        ArchivedEmotionStats.emotion_id,
+        db.func.sum(ArchivedEmotionStats.count)
+    ).filter_by(user_id=user_id).group_by(ArchivedEmotionStats.emotion_id).all()
+    for emotion_id, count in archived:
+        counts[emotion_id] = counts.get(emotion_id, 0) + count
+    return {emotion_name(emotion_id): count for emotion_id, count in counts.items()}
+
+def user_totals(user_id):
+    """Return (total records, records with input, total input length, drug mentions) over hot and archived records."""
+    hot = db.session.query(
+        db.func.count(EmotionRecord.id),
+        db.func.count(EmotionRecord.input_length),
+        db.func.coalesce(db.func.sum(EmotionRecord.input_length), 0),
+        db.func.coalesce(db.func.sum(db.case((EmotionRecord.drug_mentions == True, 1), else_=0)), 0)
+    ).filter_by(user_id=user_id).one()
+    archived = db.session.query(
+        db.func.coalesce(db.func.sum(ArchivedEmotionStats.count), 0),
+        db.func.coalesce(db.func.sum(ArchivedEmotionStats.input_count), 0),
+        db.func.coalesce(db.func.sum(ArchivedEmotionStats.input_length_sum), 0),
+        db.func.coalesce(db.func.sum(ArchivedEmotionStats.drug_mentions), 0)
+    ).filter_by(user_id=user_id).one()
+    return tuple(int(h) + int(a) for h, a in zip(hot, archived))
+
+def run_archive_cycle(app):
+    """Archive old records and apply retention."""
+    with app.app_context():
+        try:
+            moved = archive_old_records(app)
+            expired = delete_expired_partitions(app)
+            if moved or expired:
+                print(f"Archived {moved} records, deleted partitions: {', '.join(expired) or 'none'}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Archive error: {e}")
+        finally:
+            db.session.remove()
+
+def reserve_archived_ids(app):
+    """Keep new record ids above every archived id, also for databases archived before ids were autoincrement."""
+    directory = archive_dir(app)
+    last_id = 0
+    for month in list_partitions(directory):
+        connection = sqlite3.connect(partition_path(directory, month))
+        try:
+            last_id = max(last_id, connection.execute('SELECT max(id) FROM emotion_record').fetchone()[0] or 0)
+        finally:
+            connection.close()
+    with app.app_context():
+        with db.engine.begin() as connection:
+            reserve_record_ids(connection, last_id)
+
+def start_archiver(app):
+    """Run the archive cycle periodically in a background thread."""
+    interval = app.config.get('ARCHIVE_INTERVAL_SECONDS', 3600)
+    if not interval:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            run_archive_cycle(app)
+
+    thread = threading.Thread(target=loop, name='archiver', daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == '__main__':
+    # Run one archive cycle by hand
+    from app import app
+
+    run_archive_cycle(app)
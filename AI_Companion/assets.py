@@ -0,0 +1,140 @@
+"""Bundle, minify, fingerprint and precompress the static JS/CSS, and serve the results with immutable caching."""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import request, send_from_directory, url_for, abort
+
+try:
+    import brotli # optional, only .gz files are built without it
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist') # build output, served under /assets
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json') # bundle name -> fingerprinted file name
+MAX_AGE = 365 * 24 * 3600 # fingerprinted files never change, cache them for a year
+
+# bundles loaded by the templates, files are concatenated in this order
+BUNDLES = {
+    'base.css': ['css/style.css'],
+    'base.js': ['js/main.js'],
+    'dashboard.css': ['css/main.css'],
+    'dashboard.js': ['js/camera.js', 'js/speech.js'], # main.js already comes from base.js
+    'auth.css': ['css/login.css'],
+    'auth.js': ['js/saturn.js'],
+    'faq.css': ['css/faq.css'],
+    'faq.js': ['js/faq.js'],
+    'resources.css': ['css/resources.css'],
+    'resources.js': ['js/breathing.js', 'js/wellness.js', 'js/resources.js'],
+}
+
+def minify_css(source):
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S) # comments
+    source = re.sub(r'\s+', ' ', source) # collapse whitespace
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source) # spaces around punctuation (not ':' so 'a :hover' keeps its meaning)
+    return source.replace(';}', '}').strip()
+
+def minify_js(source):
+    # Conservative: only indentation, blank lines and whole-line // comments go, so strings and regexes stay intact
+    lines = []
+    for line in source.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return '\n'.join(lines)
+
+def build_bundle(name, files):
+    """Concatenate and minify the files of a bundle, or return None if none of them exist."""
+    parts = []
+    for filename in files:
+        path = os.path.join(STATIC_DIR, filename)
+        if not os.path.exists(path):
+            print(f"   ⚠ {filename} not found, skipped")
+            continue
+        with open(path, encoding='utf-8') as f:
+            parts.append(f.read())
+    if not parts:
+        return None
+    if name.endswith('.css'):
+        return '\n'.join(minify_css(part) for part in parts)
+    return '\n;\n'.join(minify_js(part) for part in parts) # ';' guards against files without a trailing semicolon
+
+def build_assets():
+    """Write fingerprinted bundles with .gz/.br variants and the manifest."""
+    os.makedirs(DIST_DIR, exist_ok=True)
+    manifest = {}
+    for name, files in BUNDLES.items():
+        content = build_bundle(name, files)
+        if content is None:
+            continue
+        data = content.encode('utf-8')
+        stem, ext = os.path.splitext(name)
+        filename = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}" # name changes whenever the content does
+        path = os.path.join(DIST_DIR, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+        manifest[name] = filename
+        print(f"   ✓ {filename}: {len(data)} bytes")
+
+    # Remove outputs of earlier builds
+    keep = set(manifest.values())
+    for existing in os.listdir(DIST_DIR):
+        base = re.sub(r'\.(gz|br)$', '', existing)
+        if existing != 'manifest.json' and base not in keep:
+            os.remove(os.path.join(DIST_DIR, existing))
+
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+def init_assets(app):
+    """Register the asset_urls template helper and the /assets route."""
+    manifest = load_manifest() if app.config.get('ASSETS_USE_BUNDLES', True) else {}
+    existing = {name: [f for f in files if os.path.exists(os.path.join(STATIC_DIR, f))] for name, files in BUNDLES.items()}
+
+    def asset_urls(bundle): # URLs to load for a bundle: the built file, or its source files before a build
+        if bundle in manifest:
+            return [url_for('assets', filename=manifest[bundle])]
+        return [url_for('static', filename=f) for f in existing[bundle]]
+
+    app.jinja_env.globals['asset_urls'] = asset_urls
+
+    @app.route('/assets/<path:filename>')
+    def assets(filename): # serve a built file, precompressed when the client accepts it
+        if filename not in manifest.values():
+            abort(404)
+        accept = request.headers.get('Accept-Encoding', '')
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if candidate in accept and os.path.exists(os.path.join(DIST_DIR, filename + suffix)):
+                encoding, filename_sent = candidate, filename + suffix
+                break
+        else:
+            filename_sent = filename
+        mimetype = mimetypes.guess_type(filename)[0]
+        response = send_from_directory(DIST_DIR, filename_sent, mimetype=mimetype, max_age=MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}, immutable'
+        return response
+
+if __name__ == '__main__':
+    print("Building static assets...")
+    built = build_assets()
+    print(f"Built {len(built)} bundles into {DIST_DIR}" + ('' if brotli else ' (install brotli for .br files)'))
@@ -0,0 +1,184 @@
+"""Index the CREMA-D, RAVDESS and SAVEE audio once into a columnar manifest and draw seeded, stratified samples from it."""
+import os
+import wave
+
+import numpy as np
+
+EMOTIONS = ['Angry', 'Disgust', 'Fear', 'Happy', 'Neutral', 'Sad'] # label order of the speech model
+DATASETS_DIR = 'datasets'
+MANIFEST_PATH = os.path.join(DATASETS_DIR, 'audio_manifest.npz')
+
+# corpus name -> audio folder under the datasets directory, as laid out by organize_datasets.py
+CORPORA = {
+    'crema-d': os.path.join('CREMA-D', 'AudioWAV'),
+    'ravdess': os.path.join('RAVDESS', 'Audio'),
+    'savee': os.path.join('SAVEE', 'AudioData'),
+}
+CREMAD_CODES = {'ANG': 0, 'DIS': 1, 'FEA': 2, 'HAP': 3, 'NEU': 4, 'SAD': 5}
+RAVDESS_CODES = {'01': 4, '03': 3, '04': 5, '05': 0, '06': 2, '07': 1} # calm (02) and surprised (08) have no class
+SAVEE_CODES = {'a': 0, 'd': 1, 'f': 2, 'h': 3, 'n': 4, 'sa': 5} # surprise (su) has no class
+
+def parse_cremad(name):
+    """1001_DFA_ANG_XX.wav -> (label, speaker)"""
+    parts = name[:-4].split('_')
+    if len(parts) >= 3 and parts[2] in CREMAD_CODES:
+        return CREMAD_CODES[parts[2]], parts[0]
+    return None
+
+def parse_ravdess(name):
+    """03-01-05-01-02-01-12.wav (modality-channel-emotion-intensity-statement-repetition-actor) -> (label, speaker)"""
+    parts = name[:-4].split('-')
+    if len(parts) == 7 and parts[2] in RAVDESS_CODES:
+        return RAVDESS_CODES[parts[2]], parts[6]
+    return None
+
+def parse_savee(name, folder=''):
+    """a01.wav / sa01.wav, with the speaker from a DC_a01.wav prefix or a DC/ folder -> (label, speaker)"""
+    stem = name[:-4]
+    speaker = folder or 'unknown' # organize_datasets.py flattens the speaker folders
+    if '_' in stem:
+        speaker, stem = stem.split('_', 1)
+    code = stem.rstrip('0123456789')
+    if code in SAVEE_CODES:
+        return SAVEE_CODES[code], speaker
+    return None
+
+PARSERS = {'crema-d': parse_cremad, 'ravdess': parse_ravdess, 'savee': parse_savee}
+
+def wav_duration(path):
+    """Length in seconds from the WAV header, NaN if the stdlib can't read it (e.g. float samples)."""
+    try:
+        with wave.open(path, 'rb') as f:
+            return f.getnframes() / f.getframerate()
+    except (wave.Error, EOFError, OSError):
+        return float('nan')
+
+def walk_corpus(corpus, directory):
+    """Yield (relative path, label, speaker) for every usable file of a corpus."""
+    parse = PARSERS[corpus]
+    for folder, _, files in os.walk(directory):
+        subfolder = os.path.relpath(folder, directory)
+        for name in sorted(files):
+            if not name.lower().endswith('.wav'):
+                continue
+            parsed = parse(name, '' if subfolder == '.' else subfolder) if corpus == 'savee' else parse(name)
+            if parsed is not None:
+                yield os.path.normpath(os.path.join(subfolder, name)), parsed[0], parsed[1]
+
+def build_manifest(root=DATASETS_DIR, path=MANIFEST_PATH):
+    """Walk every corpus once and save the labels, speakers and durations as compressed columns."""
+    corpus_names = list(CORPORA)
+    files, corpus_ids, labels, speaker_ids, durations = [], [], [], [], []
+    speakers = {} # 'corpus/speaker' -> id
+    for corpus_id, corpus in enumerate(corpus_names):
+        directory = os.path.join(root, CORPORA[corpus])
+        if not os.path.isdir(directory):
+            continue
+        for relative, label, speaker in walk_corpus(corpus, directory):
+            files.append(relative)
+            corpus_ids.append(corpus_id)
+            labels.append(label)
+            speaker_ids.append(speakers.setdefault(f'{corpus}/{speaker}', len(speakers)))
+            durations.append(wav_duration(os.path.join(directory, relative)))
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez_compressed(
+        path,
+        filename=np.array(files, dtype=str),
+        corpus=np.array(corpus_ids, dtype=np.uint8),
+        label=np.array(labels, dtype=np.uint8),
+        speaker=np.array(speaker_ids, dtype=np.uint16),
+        duration=np.array(durations, dtype=np.float32),
+        corpus_names=np.array(corpus_names, dtype=str),
+        speaker_names=np.array(list(speakers), dtype=str),
+        emotions=np.array(EMOTIONS, dtype=str)
+    )
+    return AudioManifest.load(path, root)
+
+def round_robin(indices, groups, rng):
+    """Shuffle indices, then order them so each group contributes one before any contributes a second."""
+    order = rng.permutation(len(indices))
+    indices, groups = indices[order], groups[order]
+    by_group = np.argsort(groups, kind='stable')
+    sorted_groups = groups[by_group]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(indices)]))
+    rank = np.empty(len(indices), dtype=np.int64)
+    rank[by_group] = np.arange(len(indices)) - group_start # position of each file within its group
+    return indices[np.argsort(rank, kind='stable')]
+
+# columns of the manifest, one row per audio file
+class AudioManifest:
+    def __init__(self, root, columns):
+        self.root = root
+        self.filename = columns['filename']
+        self.corpus = columns['corpus']
+        self.label = columns['label']
+        self.speaker = columns['speaker']
+        self.duration = columns['duration']
+        self.corpus_names = list(columns['corpus_names'])
+        self.speaker_names = list(columns['speaker_names'])
+
+    @classmethod
+    def load(cls, path=MANIFEST_PATH, root=DATASETS_DIR):
+        with np.load(path) as data:
+            return cls(root, {key: data[key] for key in data.files})
+
+    def __len__(self):
+        return len(self.filename)
+
+    def path(self, index):
+        corpus = self.corpus_names[self.corpus[index]]
+        return os.path.join(self.root, CORPORA[corpus], self.filename[index])
+
+    def select(self, corpora=None, min_duration=None, max_duration=None):
+        """Indices of the files from the given corpora within the duration range."""
+        mask = np.ones(len(self), dtype=bool)
+        if corpora:
+            mask &= np.isin(self.corpus, [self.corpus_names.index(c) for c in corpora if c in self.corpus_names])
+        if min_duration is not None:
+            mask &= self.duration >= min_duration
+        if max_duration is not None:
+            mask &= self.duration <= max_duration
+        return np.flatnonzero(mask)
+
+    def sample(self, per_class, seed=0, corpora=None, min_duration=None, max_duration=None):
+        """Up to per_class files of each emotion, spread evenly over speakers; the same seed gives the same sample."""
+        rng = np.random.default_rng(seed)
+        candidates = self.select(corpora, min_duration, max_duration)
+        chosen = []
+        for label in range(len(EMOTIONS)):
+            indices = candidates[self.label[candidates] == label]
+            chosen.append(round_robin(indices, self.speaker[indices], rng)[:per_class])
+        return np.sort(np.concatenate(chosen)) # file order reads the disk more sequentially
+
+    def counts(self, indices=None):
+        """Table of file counts, rows are corpora and columns are emotions."""
+        indices = np.arange(len(self)) if indices is None else indices
+        table = np.zeros((len(self.corpus_names), len(EMOTIONS)), dtype=np.int64)
+        np.add.at(table, (self.corpus[indices], self.label[indices]), 1)
+        return table
+
+def load_or_build_manifest(root=DATASETS_DIR, path=MANIFEST_PATH, rebuild=False):
+    if rebuild or not os.path.exists(path):
+        print(f"Indexing audio under {root}...")
+        return build_manifest(root, path)
+    return AudioManifest.load(path, root)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Index the speech emotion corpora into a manifest.')
+    parser.add_argument('--root', default=DATASETS_DIR, help='datasets directory')
+    parser.add_argument('--output', default=MANIFEST_PATH, help='manifest file to write')
+    args = parser.parse_args()
+
+    manifest = build_manifest(args.root, args.output)
+    table = manifest.counts()
+    print(f"\n{'':<10}" + ''.join(f'{emotion:>9}' for emotion in EMOTIONS) + f"{'speakers':>10}{'hours':>8}")
+    for corpus_id, corpus in enumerate(manifest.corpus_names):
+        rows = manifest.corpus == corpus_id
+        hours = np.nansum(manifest.duration[rows]) / 3600
+        speakers = len(np.unique(manifest.speaker[rows]))
+        print(f"{corpus:<10}" + ''.join(f'{count:>9}' for count in table[corpus_id]) + f"{speakers:>10}{hours:>8.1f}")
+    print(f"\n✓ {len(manifest)} files indexed into {args.output} ({os.path.getsize(args.output) / 1024:.0f} KB)")
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from database import db, User
+from dialogue_state import end_dialogue_session
 from werkzeug.security import generate_password_hash, check_password_hash
 
 auth_bp = Blueprint('auth', __name__)
@@ -58,6 +59,8 @@ def register():
 
 @auth_bp.route('/logout')
 def logout():
+    end_dialogue_session()
+    db.session.commit()
     session.clear()
     flash('You have been logged out', 'success')
     return redirect(url_for('auth.login'))
\ No newline at end of file
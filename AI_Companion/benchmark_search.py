@@ -0,0 +1,91 @@
+"""Benchmark the conversation search index on a large synthetic history."""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from search import FTS_SCHEMA, INSERT_SQL, SEARCH_SQL, build_match, index_row
+
+WORDS = ('sleep', 'tired', 'work', 'shift', 'colony', 'family', 'friend', 'lonely', 'anxious', 'worried', 'happy',
+         'dome', 'oxygen', 'garden', 'music', 'dream', 'night', 'morning', 'stress', 'exam', 'partner', 'ring',
+         'titan', 'saturn', 'crew', 'argument', 'better', 'breathing', 'walk', 'quiet', 'noise', 'headache')
+RESPONSES = ("I'm here to listen. What would you like to talk about?",
+             "It's okay to feel sad sometimes. I'm listening if you want to share what's on your mind.",
+             "Let's take a deep breath together and talk through it.",
+             "It's wonderful to see you feeling happy! What's bringing you joy today?")
+EMOTIONS = ('Neutral', 'Happy', 'Sad', 'Angry', 'Anxious')
+QUERIES = ('sleep', 'colony work', 'lonely night', 'breath', 'argument partner', 'headache', 'tir')
+FILLER_WORDS = 5000 # size of the background vocabulary, drawn with a Zipf-like skew like real text
+
+def make_message(rng, filler_cum_weights):
+    topic = [rng.choice(WORDS) for _ in range(rng.randint(1, 3))]
+    filler = rng.choices(range(FILLER_WORDS), cum_weights=filler_cum_weights, k=rng.randint(4, 14))
+    words = topic + [f'w{index}' for index in filler]
+    rng.shuffle(words)
+    return ' '.join(words)
+
+def build_index(path, rows, users, seed=0):
+    """Create a standalone index with `rows` synthetic messages spread over `users` users."""
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode = OFF')
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.execute(FTS_SCHEMA)
+    filler_cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(FILLER_WORDS)))
+    start = datetime(2024, 1, 1)
+    batch = []
+    for record_id in range(1, rows + 1):
+        message = make_message(rng, filler_cum_weights)
+        batch.append(index_row(record_id, rng.randint(1, users), message, rng.choice(RESPONSES),
+                               rng.choice(EMOTIONS), start + timedelta(seconds=record_id * 30)))
+        if len(batch) == 10000:
+            connection.executemany(INSERT_SQL, batch)
+            batch = []
+    if batch:
+        connection.executemany(INSERT_SQL, batch)
+    connection.commit()
+    connection.execute("INSERT INTO emotion_record_fts (emotion_record_fts) VALUES ('optimize')") # merge index segments
+    connection.commit()
+    return connection
+
+def run_queries(connection, users, repeats, per_page=20, seed=1):
+    """Time each query for random users and return {query: [milliseconds]}."""
+    rng = random.Random(seed)
+    timings = {}
+    for query in QUERIES:
+        samples = []
+        for _ in range(repeats):
+            params = {'match': build_match(query, rng.randint(1, users)), 'limit': per_page + 1, 'offset': 0}
+            start = time.perf_counter()
+            connection.execute(SEARCH_SQL, params).fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[query] = samples
+    return timings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark full-text search over conversation history.')
+    parser.add_argument('--rows', type=int, default=2000000, help='number of synthetic records')
+    parser.add_argument('--users', type=int, default=2000, help='number of users the records are spread over')
+    parser.add_argument('--repeats', type=int, default=50, help='timed runs per query')
+    parser.add_argument('--db', default='search_benchmark.db', help='index file, reused if it already exists')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        connection = sqlite3.connect(args.db)
+        print(f"Reusing {args.db}")
+    else:
+        print(f"Indexing {args.rows:,} records for {args.users:,} users...")
+        start = time.perf_counter()
+        connection = build_index(args.db, args.rows, args.users)
+        print(f"Built in {time.perf_counter() - start:.1f}s ({os.path.getsize(args.db) / 1e6:.0f} MB)")
+
+    print(f"\n{'query':<20}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for query, samples in run_queries(connection, args.users, args.repeats).items():
+        samples.sort()
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        print(f"{query:<20}{statistics.median(samples):>10.2f}{p95:>10.2f}{samples[-1]:>10.2f}")
+    connection.close()
@@ -3,4 +3,21 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'saturn-companion-secret-key-2024'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///ai_companion.db'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or 'archive' # cold storage directory, relative to the instance folder
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS') or 90) # records older than this move to cold storage
+    ARCHIVE_RETENTION_MONTHS = int(os.environ.get('ARCHIVE_RETENTION_MONTHS') or 0) # delete archive partitions older than this, 0 keeps them forever
+    ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS') or 3600) # how often the background archiver runs, 0 disables it
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') != '0' # token-bucket limits on the chat and insights APIs
+    RATELIMIT_STORAGE = os.environ.get('RATELIMIT_STORAGE') or 'memory' # 'memory', or a SQLite file in the instance folder shared by all workers
+    RATELIMIT_USER_PER_MINUTE = float(os.environ.get('RATELIMIT_USER_PER_MINUTE') or 20) # sustained requests per user
+    RATELIMIT_USER_BURST = int(os.environ.get('RATELIMIT_USER_BURST') or 5) # requests a user can make back to back
+    RATELIMIT_GLOBAL_PER_SECOND = float(os.environ.get('RATELIMIT_GLOBAL_PER_SECOND') or 20) # sustained requests for all users together
+    RATELIMIT_GLOBAL_BURST = int(os.environ.get('RATELIMIT_GLOBAL_BURST') or 40) # requests all users together can make back to back
+    RATELIMIT_IDLE_SECONDS = int(os.environ.get('RATELIMIT_IDLE_SECONDS') or 600) # forget buckets of users idle this long
+    DIALOGUE_MAX_SESSIONS = int(os.environ.get('DIALOGUE_MAX_SESSIONS') or 5000) # chat session states kept in memory
+    DIALOGUE_WRITE_EVERY = int(os.environ.get('DIALOGUE_WRITE_EVERY') or 5) # turns between writes of a session state to the database
+    DIALOGUE_IDLE_SECONDS = int(os.environ.get('DIALOGUE_IDLE_SECONDS') or 1800) # idle time after which a new chat session starts
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES') or 2000) # rendered page fragments kept in memory
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES') or 8 * 1024 * 1024) # memory budget for the fragment cache
+    ASSETS_USE_BUNDLES = os.environ.get('ASSETS_USE_BUNDLES', '1') != '0' # serve the files built by assets.py when they exist
\ No newline at end of file
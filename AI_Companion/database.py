@@ -1,4 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
 from datetime import datetime
 import json
 
@@ -29,19 +31,246 @@ class Session(db.Model):
     def set_session_data(self, data): # set session data from the dictionary
         self.session_data = json.dumps(data) # covert dictionary to JSON string
 
-# emotion record model to log detected emotions
+# emotion lookup model, one row per canonical emotion
+class Emotion(db.Model):
+    id = db.Column(db.SmallInteger, primary_key=True) # emotion code
+    name = db.Column(db.String(20), unique=True, nullable=False) # canonical emotion name
+
+# canonical emotions, the code is the position in this tuple plus one (only ever append to it)
+EMOTIONS = ('Neutral', 'Happy', 'Sad', 'Angry', 'Anxious', 'Fear', 'Surprise', 'Disgust', 'Contempt')
+EMOTION_CODES = {name.lower(): code for code, name in enumerate(EMOTIONS, start=1)} # lower-case name -> code
+EMOTION_ALIASES = { # other spellings sent by the client or the models
+    'anger': 'angry', 'mad': 'angry', 'sadness': 'sad', 'happiness': 'happy', 'anxiety': 'anxious',
+    'fearful': 'fear', 'scared': 'fear', 'surprised': 'surprise', 'disgusted': 'disgust', 'calm': 'neutral'
+}
+
+def emotion_code(name): # code for any spelling of an emotion, unknown emotions count as neutral
+    key = (name or '').strip().lower()
+    return EMOTION_CODES.get(EMOTION_ALIASES.get(key, key), EMOTION_CODES['neutral'])
+
+def emotion_name(code): # canonical name for an emotion code
+    return EMOTIONS[code - 1] if code and 0 < code <= len(EMOTIONS) else EMOTIONS[0]
+
+def canonical_emotion(name): # canonical name for any spelling of an emotion
+    return emotion_name(emotion_code(name))
+
+# response template model, one row per fixed AI response text
+class ResponseTemplate(db.Model):
+    id = db.Column(db.Integer, primary_key=True) # stable template id
+    text = db.Column(db.Text, unique=True, nullable=False) # response text
+
+# in-memory map between template ids and response texts
+class ResponseTemplateRegistry:
+    def __init__(self):
+        self.text_to_id = {} # response text -> template id
+        self.id_to_text = {} # template id -> response text
+
+    def load(self): # read every template from the database
+        rows = db.session.query(ResponseTemplate.id, ResponseTemplate.text).all()
+        self.id_to_text = dict(rows)
+        self.text_to_id = {text: template_id for template_id, text in rows}
+
+    def sync(self, texts): # add new template texts, existing ids never change; returns the texts this call added
+        self.load()
+        missing = [text for text in dict.fromkeys(texts) if text not in self.text_to_id]
+        if missing:
+            db.session.add_all([ResponseTemplate(text=text) for text in missing])
+            try:
+                db.session.commit()
+            except IntegrityError: # another worker inserted the same texts first, and interns them
+                db.session.rollback()
+                missing = []
+        self.load()
+        return missing
+
+    def get_id(self, text): # template id for a response text, None for free text
+        return self.text_to_id.get(text)
+
+    def get_text(self, template_id): # response text for a template id
+        return self.id_to_text.get(template_id)
+
+response_templates = ResponseTemplateRegistry() # shared registry used by EmotionRecord
+
+# emotion record model to log detected emotions, only fixed-width columns so aggregates scan narrow rows
 class EmotionRecord(db.Model):
+    __table_args__ = (
+        db.Index('ix_emotion_record_user_timestamp', 'user_id', 'timestamp'), # per-user history lookups
+        {'sqlite_autoincrement': True} # never hand out the id of a deleted (archived) record again
+    )
+
     id = db.Column(db.Integer, primary_key=True) # record id
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # foreign key to user
-    emotion = db.Column(db.String(50), nullable=False) # detected emotion
+    emotion_id = db.Column(db.SmallInteger, db.ForeignKey('emotion.id'), nullable=False) # detected emotion code
     confidence = db.Column(db.Float) # confidence level of the detected emotion
     timestamp = db.Column(db.DateTime, default=datetime.utcnow) # timestamp of the record
     session_id = db.Column(db.Integer, db.ForeignKey('session.id')) # foreign key to session
-    user_input = db.Column(db.Text) # user input text
-    ai_response = db.Column(db.Text) # AI response text
     drug_mentions = db.Column(db.Boolean, default=False) # whether drug mentions were detected
+    input_length = db.Column(db.Integer) # length of the user input, None if there was no input
+
+    text = db.relationship('EmotionRecordText', uselist=False, lazy='joined', cascade='all, delete-orphan') # user input and AI response
+
+    def _text(self): # text row of this record, created on first write
+        if self.text is None:
+            self.text = EmotionRecordText()
+        return self.text
+
+    @property
+    def emotion(self): # canonical emotion name
+        return emotion_name(self.emotion_id)
+
+    @emotion.setter
+    def emotion(self, name):
+        self.emotion_id = emotion_code(name)
+
+    @property
+    def user_input(self): # user input text
+        return self.text.user_input if self.text else None
+
+    @user_input.setter
+    def user_input(self, text):
+        self._text().user_input = text
+        self.input_length = len(text) if text is not None else None
+
+    @property
+    def ai_response(self): # AI response text
+        return self.text.ai_response if self.text else None
+
+    @ai_response.setter
+    def ai_response(self, text):
+        self._text().ai_response = text
+
+# text columns of an emotion record, kept apart so the record table stays narrow
+class EmotionRecordText(db.Model):
+    record_id = db.Column(db.Integer, db.ForeignKey('emotion_record.id'), primary_key=True) # foreign key to emotion record
+    user_input = db.Column(db.Text) # user input text
+    ai_response_text = db.Column('ai_response', db.Text) # AI response text, only for responses that are not templates
+    ai_response_template_id = db.Column(db.Integer, db.ForeignKey('response_template.id')) # AI response template
+
+    @property
+    def ai_response(self): # AI response text, rehydrated from the template map when possible
+        if self.ai_response_template_id is not None:
+            return response_templates.get_text(self.ai_response_template_id)
+        return self.ai_response_text
+
+    @ai_response.setter
+    def ai_response(self, text): # store a template id for known responses and the full text otherwise
+        self.ai_response_template_id = response_templates.get_id(text)
+        self.ai_response_text = text if self.ai_response_template_id is None else None
+
+# monthly per-user emotion totals for records that were moved to the archive
+class ArchivedEmotionStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True) # foreign key to user
+    month = db.Column(db.String(7), primary_key=True) # archive partition the records went to (YYYY-MM)
+    emotion_id = db.Column(db.SmallInteger, db.ForeignKey('emotion.id'), primary_key=True) # detected emotion code
+    count = db.Column(db.Integer, default=0, nullable=False) # number of archived records
+    input_count = db.Column(db.Integer, default=0, nullable=False) # number of archived records with user input
+    input_length_sum = db.Column(db.Integer, default=0, nullable=False) # total length of the archived user inputs
+    drug_mentions = db.Column(db.Integer, default=0, nullable=False) # number of archived records with drug mentions
+
+def emotion_code_sql(column): # SQL expression mapping a free-form emotion column to its code
+    cases = ' '.join(f"WHEN '{name}' THEN {emotion_code(name)}" for name in list(EMOTION_CODES) + list(EMOTION_ALIASES))
+    return f"CASE lower(trim({column})) {cases} ELSE {EMOTION_CODES['neutral']} END"
+
+def seed_emotions(connection): # add missing rows to the emotion lookup table
+    Emotion.__table__.create(connection, checkfirst=True)
+    existing = {row[0] for row in connection.execute(db.select(Emotion.id))}
+    missing = [{'id': code, 'name': name} for code, name in enumerate(EMOTIONS, start=1) if code not in existing]
+    if missing:
+        connection.execute(Emotion.__table__.insert(), missing)
+
+def rebuild_table(connection, model, select_sql): # recreate a model's table from a SELECT, swapped in only once it is full
+    table = model.__table__
+    new_name = f'{table.name}_new'
+    connection.execute(db.text(f'DROP TABLE IF EXISTS {new_name}')) # leftover of a rebuild that never committed
+    create_sql = str(CreateTable(table).compile(dialect=connection.dialect)) # table only, the index names are still taken
+    connection.execute(db.text(create_sql.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {new_name} ', 1)))
+    columns = ', '.join(column.name for column in table.columns)
+    connection.execute(db.text(f'INSERT INTO {new_name} ({columns}) {select_sql}'))
+    connection.execute(db.text(f'DROP TABLE IF EXISTS {table.name}'))
+    connection.execute(db.text(f'ALTER TABLE {new_name} RENAME TO {table.name}'))
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+def migrate_emotion_records(connection, source, columns): # move to emotion codes and a separate text table
+    seed_emotions(connection)
+    ResponseTemplate.__table__.create(connection, checkfirst=True)
+    EmotionRecordText.__table__.create(connection, checkfirst=True)
+    template_id = 'o.ai_response_template_id' if 'ai_response_template_id' in columns else 'NULL'
+    connection.execute(db.text( # texts first, known responses interned as template ids
+        'INSERT OR REPLACE INTO emotion_record_text (record_id, user_input, ai_response, ai_response_template_id) '
+        f'SELECT o.id, o.user_input, CASE WHEN coalesce({template_id}, rt.id) IS NULL THEN o.ai_response END, coalesce({template_id}, rt.id) '
+        f'FROM {source} o LEFT JOIN response_template rt ON rt.text = o.ai_response'
+    ))
+    rebuild_table(connection, EmotionRecord,
+                  f'SELECT id, user_id, {emotion_code_sql("emotion")}, confidence, timestamp, session_id, drug_mentions, length(user_input) '
+                  f'FROM {source}')
+    if source != EmotionRecord.__tablename__:
+        connection.execute(db.text(f'DROP TABLE IF EXISTS {source}'))
+
+def migrate_archived_stats(connection): # move archive rollups to emotion codes, merging differently spelled emotions
+    seed_emotions(connection)
+    code = emotion_code_sql('emotion')
+    rebuild_table(connection, ArchivedEmotionStats,
+                  f'SELECT user_id, month, {code}, SUM(count), SUM(input_count), SUM(input_length_sum), SUM(drug_mentions) '
+                  f'FROM archived_emotion_stats GROUP BY user_id, month, {code}')
+
+def table_sql(connection, name): # CREATE TABLE statement of a SQLite table
+    return connection.execute(db.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': name}).scalar() or ''
+
+def reserve_record_ids(connection, last_id): # make new records get ids above last_id (e.g. the highest archived id)
+    if not last_id or db.engine.dialect.name != 'sqlite':
+        return
+    seq = connection.execute(db.text("SELECT seq FROM sqlite_sequence WHERE name = 'emotion_record'")).first()
+    if seq is None:
+        connection.execute(db.text("INSERT INTO sqlite_sequence (name, seq) VALUES ('emotion_record', :id)"), {'id': last_id})
+    elif seq[0] < last_id:
+        connection.execute(db.text("UPDATE sqlite_sequence SET seq = :id WHERE name = 'emotion_record'"), {'id': last_id})
+
+def upgrade_db(): # bring tables created by older versions up to date, in place and all or nothing
+    inspector = db.inspect(db.engine)
+    tables = inspector.get_table_names()
+    with db.engine.begin() as connection:
+        if db.engine.dialect.name == 'sqlite':
+            connection.execute(db.text('BEGIN IMMEDIATE')) # pysqlite would otherwise run the DDL outside the transaction
+
+        source = 'emotion_record'
+        if 'emotion_record_old' in tables: # left behind by an interrupted migration of an older version
+            current = connection.execute(db.text('SELECT count(*) FROM emotion_record')).scalar() if 'emotion_record' in tables else 0
+            if current:
+                print("⚠ emotion_record_old and a non-empty emotion_record both exist, leaving emotion_record_old for manual recovery")
+            else:
+                source = 'emotion_record_old'
+        if source in tables:
+            columns = {column['name'] for column in inspector.get_columns(source)}
+            if 'emotion' in columns: # free-form emotion and text columns on the record itself
+                migrate_emotion_records(connection, source, columns)
+            elif db.engine.dialect.name == 'sqlite' and 'AUTOINCREMENT' not in table_sql(connection, source).upper(): # ids could be reused
+                columns = ', '.join(column.name for column in EmotionRecord.__table__.columns)
+                rebuild_table(connection, EmotionRecord, f'SELECT {columns} FROM {source}')
+                if source != EmotionRecord.__tablename__:
+                    connection.execute(db.text(f'DROP TABLE IF EXISTS {source}'))
+        if 'archived_emotion_stats' in tables:
+            columns = {column['name'] for column in inspector.get_columns('archived_emotion_stats')}
+            if 'emotion' in columns:
+                migrate_archived_stats(connection)
 
 def init_db(app): # initialize the database with the Flask app
     db.init_app(app) # bind the database to teh app
     with app.app_context(): # create all tables
-        db.create_all() # create database tables
\ No newline at end of file
+        upgrade_db() # bring older databases up to date
+        db.create_all() # create database tables
+        with db.engine.begin() as connection:
+            seed_emotions(connection) # fill the emotion lookup table
+
+def init_response_templates(app, texts): # register the fixed AI responses and intern existing records
+    with app.app_context():
+        added = response_templates.sync(texts)
+        if not added: # nothing new to intern, skip the scan of the text table
+            return
+        # Replace stored texts that match a new template with the template id (migrated rows are interned by upgrade_db)
+        db.session.execute(db.text(
+            'UPDATE emotion_record_text SET ai_response_template_id = '
+            '(SELECT id FROM response_template WHERE response_template.text = emotion_record_text.ai_response), ai_response = NULL '
+            'WHERE ai_response IN :texts'
+        ).bindparams(db.bindparam('texts', expanding=True)), {'texts': added})
+        db.session.commit()
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""Per-session dialogue state for the chat, held in memory and written back to the Session table."""
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import session
+
+from database import db, Session, EmotionRecord, emotion_code, emotion_name
+
+MAX_TRAJECTORY = 50 # emotions remembered per session, oldest dropped first
+
+# what the conversation AI needs to know about the earlier turns of a chat session
+class DialogueState:
+    __slots__ = ('session_id', 'user_id', 'topic', 'last_rule', 'turns', 'emotions', 'updated', 'unsaved')
+
+    def __init__(self, session_id, user_id, data=None):
+        data = data or {}
+        self.session_id = session_id
+        self.user_id = user_id
+        self.topic = data.get('topic') # emotion being talked about ('sad', 'anxious', 'angry') or None
+        self.last_rule = data.get('last_rule') # response rule that answered the previous message
+        self.turns = data.get('turns', 0)
+        self.emotions = data.get('emotions', []) # emotion codes of the recent turns, oldest first
+        self.updated = data.get('updated', time.time()) # time of the last turn
+        self.unsaved = 0 # turns not written back yet
+
+    def record_turn(self, rule, topic, emotion):
+        self.last_rule = rule
+        self.topic = topic
+        self.turns += 1
+        self.emotions.append(emotion_code(emotion))
+        del self.emotions[:-MAX_TRAJECTORY]
+        self.updated = time.time()
+        self.unsaved += 1
+
+    def trajectory(self):
+        return [emotion_name(code) for code in self.emotions]
+
+    def to_dict(self):
+        return {
+            'topic': self.topic,
+            'last_rule': self.last_rule,
+            'turns': self.turns,
+            'emotions': self.emotions,
+            'updated': self.updated
+        }
+
+# states of the active chat sessions, least recently used first
+class DialogueStateStore:
+    def __init__(self, max_sessions=5000, write_every=5, idle_seconds=1800):
+        self.max_sessions = max_sessions # most states kept in memory, the least recently used is written back and dropped
+        self.write_every = write_every # write a state back to the database once per this many turns
+        self.idle_seconds = idle_seconds # a session without a turn for this long is ended and a new one started
+        self.states = OrderedDict() # session id -> DialogueState
+        self.lock = threading.Lock()
+
+    def get(self, session_id, user_id):
+        """State of an open session of this user, or None; reloaded when the Session row holds newer turns."""
+        row = db.session.get(Session, session_id) # the row is shared by every process, the cached state is not
+        if row is None or row.user_id != user_id or row.end_time is not None:
+            with self.lock:
+                self.states.pop(session_id, None) # ended by another process
+            return None
+        data = row.get_session_data()
+        with self.lock:
+            state = self.states.get(session_id)
+            if state is not None:
+                self.states.move_to_end(session_id) # most recently used goes last
+        if state is None or data.get('updated', 0) > state.updated: # missing, or another process wrote later turns
+            state = DialogueState(session_id, user_id, data)
+            self.put(state)
+        if time.time() - state.updated > self.idle_seconds:
+            self.end(session_id, user_id)
+            return None
+        return state
+
+    def start(self, user_id):
+        """Create the Session row of a new chat session; call inside the request's transaction."""
+        row = Session(user_id=user_id)
+        db.session.add(row)
+        db.session.flush() # assign the session id
+        state = DialogueState(row.id, user_id)
+        self.put(state)
+        return state
+
+    def put(self, state):
+        with self.lock:
+            self.states[state.session_id] = state
+            evicted = []
+            while len(self.states) > self.max_sessions:
+                evicted.append(self.states.popitem(last=False)[1])
+        for old in evicted:
+            self.write(old)
+
+    def write(self, state, row=None):
+        """Copy unsaved turns into the Session row; they are stored with the current transaction."""
+        if not state.unsaved:
+            return
+        row = row or db.session.get(Session, state.session_id)
+        if row is not None:
+            row.set_session_data(state.to_dict())
+        state.unsaved = 0
+
+    def save(self, state):
+        """Write back once every write_every turns instead of on every message."""
+        if state.unsaved >= self.write_every:
+            self.write(state)
+
+    def flush(self):
+        """Write back every state with unsaved turns; commit afterwards."""
+        with self.lock:
+            states = list(self.states.values())
+        for state in states:
+            self.write(state)
+
+    def end(self, session_id, user_id):
+        """Write back the final state and close the session."""
+        with self.lock:
+            state = self.states.pop(session_id, None)
+        row = db.session.get(Session, session_id)
+        if row is None or row.user_id != user_id or row.end_time is not None:
+            return
+        if state is not None:
+            self.write(state, row)
+        row.end_time = datetime.utcnow()
+
+dialogue_states = DialogueStateStore() # per-process cache, the Session rows are the shared copy
+
+def close_idle_sessions(idle_seconds, now=None):
+    """End the sessions earlier processes left open once they have been idle, at the time of their last turn."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=idle_seconds)
+    candidates = {}
+    for row in Session.query.filter(Session.end_time.is_(None)):
+        updated = row.get_session_data().get('updated')
+        last = datetime.utcfromtimestamp(updated) if updated else row.start_time
+        if last is None or last < cutoff:
+            candidates[row.id] = (row, last)
+    ids = list(candidates)
+    for start in range(0, len(ids), 500): # turns below write_every are only in the records
+        last_turns = db.session.query(
+            EmotionRecord.session_id,
+            db.func.max(EmotionRecord.timestamp)
+        ).filter(EmotionRecord.session_id.in_(ids[start:start + 500])).group_by(EmotionRecord.session_id)
+        for session_id, last in last_turns:
+            row, saved = candidates[session_id]
+            candidates[session_id] = (row, max(last, saved) if saved else last)
+    closed = 0
+    for row, last in candidates.values():
+        if last is None or last < cutoff:
+            row.end_time = last or now
+            closed += 1
+    return closed
+
+def flush_dialogue_states(app):
+    """Write back the unsaved turns at shutdown so a restart does not lose them."""
+    with app.app_context():
+        try:
+            dialogue_states.flush()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Dialogue state flush error: {e}")
+
+def init_dialogue_states(app):
+    """Apply the configured limits, close sessions left open by earlier processes and flush the states at exit."""
+    dialogue_states.max_sessions = app.config.get('DIALOGUE_MAX_SESSIONS', 5000)
+    dialogue_states.write_every = app.config.get('DIALOGUE_WRITE_EVERY', 5)
+    dialogue_states.idle_seconds = app.config.get('DIALOGUE_IDLE_SECONDS', 1800)
+    with app.app_context():
+        closed = close_idle_sessions(dialogue_states.idle_seconds)
+        db.session.commit()
+    if closed:
+        print(f"Closed {closed} idle chat sessions")
+    atexit.register(flush_dialogue_states, app)
+
+def current_dialogue_state(user_id):
+    """State of the browser's chat session, starting a new session when there is none or it went idle."""
+    state = None
+    if 'chat_session_id' in session:
+        state = dialogue_states.get(session['chat_session_id'], user_id)
+    if state is None:
+        state = dialogue_states.start(user_id)
+        session['chat_session_id'] = state.session_id
+    return state
+
+def end_dialogue_session():
+    """Close the browser's chat session (on logout); commit afterwards."""
+    session_id = session.pop('chat_session_id', None)
+    if session_id is not None and 'user_id' in session:
+        dialogue_states.end(session_id, session['user_id'])
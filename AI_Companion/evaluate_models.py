@@ -1,15 +1,14 @@
-"""Evaluate trained facial and speech emotion models to diagnose accuracy issues."""
+"""Evaluate trained facial and speech emotion models to diagnose accuracy issues, and benchmark their inference speed."""
+import argparse
+import contextlib
+import json
+import time
 import torch
 import torch.nn as nn
 import numpy as np
 from torch.utils.data import Dataset, DataLoader
-import torchvision.transforms as transforms
 from PIL import Image
 import os
-import librosa
-from sklearn.metrics import confusion_matrix, classification_report
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 # Import model architectures from robot_companion
 import sys
@@ -94,154 +93,271 @@ class CKPlusDataset(Dataset):
             image = self.transform(image)
         return image, label
 
-def evaluate_facial_model():
-    """Evaluate facial emotion model."""
-    print("\n=== Evaluating Facial Emotion Model ===")
-    
-    # Load model
+
+FACIAL_EMOTIONS = ['Anger', 'Contempt', 'Disgust', 'Fear', 'Happy', 'Sadness', 'Surprise']
+SPEECH_EMOTIONS = ['Angry', 'Disgust', 'Fear', 'Happy', 'Neutral', 'Sad']
+
+# model class, weights file, number of classes and the shape of one input sample
+BENCHMARK_MODELS = {
+    'facial': (FacialExpressionCNN, 'models/emotion_model.pth', 7, (1, 48, 48)),
+    'speech': (AudioCNN, 'models/speech_model.pth', 6, (1, 128, 128)),
+}
+INFERENCE_MODES = ('eager', 'no_grad', 'inference_mode') # eager keeps autograd on, like a forgotten no_grad
+ACCURACY_TOLERANCE = 0.01 # drop in accuracy or macro F1 against the baseline that counts as a regression
+
+def confusion_matrix(labels, preds, num_classes):
+    """Confusion matrix (rows are true labels) computed with a single bincount."""
+    labels = np.asarray(labels, dtype=np.int64)
+    preds = np.asarray(preds, dtype=np.int64)
+    counts = np.bincount(labels * num_classes + preds, minlength=num_classes * num_classes)
+    return counts.reshape(num_classes, num_classes)
+
+def class_metrics(cm, names):
+    """Accuracy, macro/weighted F1 and per-class precision, recall and F1 from a confusion matrix."""
+    tp = np.diag(cm).astype(np.float64)
+    support = cm.sum(axis=1)
+    predicted = cm.sum(axis=0)
+    total = int(support.sum())
+    with np.errstate(divide='ignore', invalid='ignore'): # empty classes score 0 instead of NaN
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    present = support > 0 # classes missing from the test set don't drag the macro average down
+    return {
+        'samples': total,
+        'accuracy': round(float(tp.sum() / total), 4) if total else 0.0,
+        'macro_f1': round(float(f1[present].mean()), 4) if present.any() else 0.0,
+        'weighted_f1': round(float((f1 * support).sum() / total), 4) if total else 0.0,
+        'per_class': {
+            name: {
+                'precision': round(float(precision[i]), 4),
+                'recall': round(float(recall[i]), 4), # same as the per-class accuracy
+                'f1': round(float(f1[i]), 4),
+                'support': int(support[i])
+            } for i, name in enumerate(names)
+        },
+        'confusion_matrix': cm.tolist()
+    }
+
+def print_report(metrics):
+    print(f"\n{'':<12}{'precision':>10}{'recall':>10}{'f1':>10}{'support':>10}")
+    for name, stats in metrics['per_class'].items():
+        print(f"{name:<12}{stats['precision']:>10.2f}{stats['recall']:>10.2f}{stats['f1']:>10.2f}{stats['support']:>10}")
+    print(f"\nAccuracy: {metrics['accuracy'] * 100:.2f}% on {metrics['samples']} samples "
+          f"(macro F1 {metrics['macro_f1']:.3f}, weighted F1 {metrics['weighted_f1']:.3f})")
+
+def plot_confusion_matrix(metrics, names, title, cmap, path):
+    """Save the confusion matrix as a heatmap; matplotlib and seaborn are only imported here."""
+    import matplotlib
+    matplotlib.use('Agg') # render to file, no display needed
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.figure(figsize=(10, 8))
+    sns.heatmap(np.array(metrics['confusion_matrix']), annot=True, fmt='d', cmap=cmap, xticklabels=names, yticklabels=names)
+    plt.title(title)
+    plt.ylabel('True Label')
+    plt.xlabel('Predicted Label')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+    print(f"\nConfusion matrix saved to {path}")
+
+def facial_predictions(batch_size=32):
+    """Run the facial model over CK+ and return (labels, predictions) as arrays."""
+    import torchvision.transforms as transforms
+
     model = FacialExpressionCNN(num_classes=7)
     model.load_state_dict(torch.load('models/emotion_model.pth', map_location='cpu'))
     model.eval()
     
-    # Prepare dataset
     transform = transforms.Compose([
         transforms.Grayscale(),
         transforms.Resize((48, 48)),
         transforms.ToTensor(),
         transforms.Normalize(mean=[0.5], std=[0.5])
     ])
-    
     dataset = CKPlusDataset('datasets/CK+/CK+48', transform=transform)
-    dataloader = DataLoader(dataset, batch_size=32, shuffle=False)
+    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
     
-    # Evaluate
     all_preds = []
     all_labels = []
-    
-    with torch.no_grad():
+    with torch.inference_mode():
         for images, labels in dataloader:
-            outputs = model(images)
-            _, predicted = torch.max(outputs.data, 1)
-            all_preds.extend(predicted.cpu().numpy())
-            all_labels.extend(labels.cpu().numpy())
-    
-    # Calculate metrics
-    emotion_names = ['Anger', 'Contempt', 'Disgust', 'Fear', 'Happy', 'Sadness', 'Surprise']
-    cm = confusion_matrix(all_labels, all_preds)
+            all_preds.append(model(images).argmax(dim=1).numpy())
+            all_labels.append(labels.numpy())
+    if not all_preds:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(all_labels), np.concatenate(all_preds)
+
+def speech_features(audio_path):
+    """Normalised 128x128 log-mel spectrogram of the first 3 seconds of a file."""
+    import librosa
+
+    audio, sr = librosa.load(audio_path, sr=16000, duration=3.0)
     
-    print("\nClassification Report:")
-    print(classification_report(all_labels, all_preds, target_names=emotion_names, zero_division=0))
+    # Extract mel spectrogram
+    mel_spec = librosa.feature.melspectrogram(y=audio, sr=sr, n_mels=128, fmax=8000)
+    mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
     
-    # Plot confusion matrix
-    plt.figure(figsize=(10, 8))
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=emotion_names, yticklabels=emotion_names)
-    plt.title('Facial Emotion Recognition - Confusion Matrix')
-    plt.ylabel('True Label')
-    plt.xlabel('Predicted Label')
-    plt.tight_layout()
-    plt.savefig('facial_confusion_matrix.png')
-    print(f"\nConfusion matrix saved to facial_confusion_matrix.png")
+    # Resize to fixed shape
+    if mel_spec_db.shape[1] < 128:
+        pad_width = 128 - mel_spec_db.shape[1]
+        mel_spec_db = np.pad(mel_spec_db, ((0, 0), (0, pad_width)), mode='constant')
+    else:
+        mel_spec_db = mel_spec_db[:, :128]
     
-    # Calculate per-class accuracy
-    print("\nPer-Class Accuracy:")
-    for i, emotion in enumerate(emotion_names):
-        if cm[i].sum() > 0:
-            accuracy = cm[i][i] / cm[i].sum() * 100
-            print(f"{emotion}: {accuracy:.2f}%")
+    # Normalize
+    return (mel_spec_db - mel_spec_db.mean()) / (mel_spec_db.std() + 1e-8)
+
+def speech_predictions(batch_size=32, per_class=100, seed=0, corpora=None):
+    """Run the speech model over a balanced sample of the audio manifest and return (labels, predictions) as arrays."""
+    from audio_manifest import load_or_build_manifest
 
-def evaluate_speech_model():
-    """Evaluate speech emotion model."""
-    print("\n=== Evaluating Speech Emotion Model ===")
-    
-    # Load model
     model = AudioCNN(num_classes=6)
     model.load_state_dict(torch.load('models/speech_model.pth', map_location='cpu'))
     model.eval()
     
-    # Load test data
-    audio_dir = 'datasets/CREMA-D/AudioWAV'
-    if not os.path.exists(audio_dir):
-        print(f"Audio directory not found: {audio_dir}")
-        return
+    # Same files for the same seed, evenly spread over emotions and speakers
+    manifest = load_or_build_manifest()
+    indices = manifest.sample(per_class, seed=seed, corpora=corpora)
     
-    emotion_map = {'ANG': 0, 'DIS': 1, 'FEA': 2, 'HAP': 3, 'NEU': 4, 'SAD': 5}
-    emotion_names = ['Angry', 'Disgust', 'Fear', 'Happy', 'Neutral', 'Sad']
+    print(f"Evaluating on {len(indices)} audio samples...")
     
-    all_preds = []
+    features = []
     all_labels = []
+    for index in indices:
+        try:
+            features.append(speech_features(manifest.path(index)))
+        except Exception:
+            continue
+        all_labels.append(int(manifest.label[index]))
     
-    # Process sample of audio files (limit to avoid long processing)
-    audio_files = [f for f in os.listdir(audio_dir) if f.endswith('.wav')][:500]
-    
-    print(f"Evaluating on {len(audio_files)} audio samples...")
-    
-    for audio_file in audio_files:
-        # Parse emotion from filename (CREMA-D format: 1001_DFA_ANG_XX.wav)
-        parts = audio_file.split('_')
-        if len(parts) >= 3:
-            emotion_code = parts[2]
-            if emotion_code in emotion_map:
-                label = emotion_map[emotion_code]
-                
-                # Load and process audio
-                audio_path = os.path.join(audio_dir, audio_file)
-                try:
-                    audio, sr = librosa.load(audio_path, sr=16000, duration=3.0)
-                    
-                    # Extract mel spectrogram
-                    mel_spec = librosa.feature.melspectrogram(y=audio, sr=sr, n_mels=128, fmax=8000)
-                    mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
-                    
-                    # Resize to fixed shape
-                    if mel_spec_db.shape[1] < 128:
-                        pad_width = 128 - mel_spec_db.shape[1]
-                        mel_spec_db = np.pad(mel_spec_db, ((0, 0), (0, pad_width)), mode='constant')
-                    else:
-                        mel_spec_db = mel_spec_db[:, :128]
-                    
-                    # Normalize
-                    mel_spec_db = (mel_spec_db - mel_spec_db.mean()) / (mel_spec_db.std() + 1e-8)
-                    
-                    # Convert to tensor
-                    input_tensor = torch.FloatTensor(mel_spec_db).unsqueeze(0).unsqueeze(0)
-                    
-                    # Predict
-                    with torch.no_grad():
-                        output = model(input_tensor)
-                        _, predicted = torch.max(output.data, 1)
-                        all_preds.append(predicted.item())
-                        all_labels.append(label)
-                except Exception as e:
-                    continue
-    
-    if len(all_preds) == 0:
+    # Predict in batches instead of one file at a time
+    all_preds = []
+    with torch.inference_mode():
+        for start in range(0, len(features), batch_size):
+            batch = torch.from_numpy(np.stack(features[start:start + batch_size]).astype(np.float32)).unsqueeze(1)
+            all_preds.append(model(batch).argmax(dim=1).numpy())
+    if not all_preds:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.array(all_labels, dtype=np.int64), np.concatenate(all_preds)
+
+def evaluate_facial_model(plot=True):
+    """Evaluate facial emotion model."""
+    print("\n=== Evaluating Facial Emotion Model ===")
+    labels, preds = facial_predictions()
+    metrics = class_metrics(confusion_matrix(labels, preds, len(FACIAL_EMOTIONS)), FACIAL_EMOTIONS)
+    print_report(metrics)
+    if plot:
+        plot_confusion_matrix(metrics, FACIAL_EMOTIONS, 'Facial Emotion Recognition - Confusion Matrix', 'Blues', 'facial_confusion_matrix.png')
+    return metrics
+
+def evaluate_speech_model(plot=True, per_class=100, seed=0, corpora=None):
+    """Evaluate speech emotion model."""
+    print("\n=== Evaluating Speech Emotion Model ===")
+    labels, preds = speech_predictions(per_class=per_class, seed=seed, corpora=corpora)
+    if len(preds) == 0:
         print("No valid predictions made")
-        return
+        return None
+    metrics = class_metrics(confusion_matrix(labels, preds, len(SPEECH_EMOTIONS)), SPEECH_EMOTIONS)
+    print_report(metrics)
+    if plot:
+        plot_confusion_matrix(metrics, SPEECH_EMOTIONS, 'Speech Emotion Recognition - Confusion Matrix', 'Greens', 'speech_confusion_matrix.png')
+    return metrics
+
+def inference_context(mode):
+    if mode == 'no_grad':
+        return torch.no_grad()
+    if mode == 'inference_mode':
+        return torch.inference_mode()
+    return torch.enable_grad() # eager: autograd records every forward pass
+
+def benchmark_model(name, batch_sizes, threads, modes, iterations=30, warmup=3, load_weights=True):
+    """Time forward passes for every thread count, batch size and inference mode; return {config: stats}."""
+    model_class, weights_path, num_classes, sample_shape = BENCHMARK_MODELS[name]
+    model = model_class(num_classes=num_classes)
+    if load_weights and os.path.exists(weights_path): # timings don't depend on the weights, random ones are fine without the file
+        model.load_state_dict(torch.load(weights_path, map_location='cpu'))
+    model.eval()
     
-    # Calculate metrics
-    cm = confusion_matrix(all_labels, all_preds)
+    results = {}
+    default_threads = torch.get_num_threads()
+    try:
+        for num_threads in threads:
+            torch.set_num_threads(num_threads)
+            for batch_size in batch_sizes:
+                inputs = torch.randn(batch_size, *sample_shape)
+                for mode in modes:
+                    timings = np.empty(iterations)
+                    with inference_context(mode):
+                        for _ in range(warmup):
+                            model(inputs)
+                        for i in range(iterations):
+                            start = time.perf_counter()
+                            model(inputs)
+                            timings[i] = time.perf_counter() - start
+                    key = f'{name}/batch={batch_size}/threads={num_threads}/{mode}'
+                    results[key] = {
+                        'p50_ms': round(float(np.percentile(timings, 50)) * 1000, 3), # latency of one batch
+                        'p95_ms': round(float(np.percentile(timings, 95)) * 1000, 3),
+                        'throughput': round(batch_size * iterations / float(timings.sum()), 1) # samples per second
+                    }
+                    print(f"{key:<45}{results[key]['p50_ms']:>10.2f}{results[key]['p95_ms']:>10.2f}{results[key]['throughput']:>12.1f}")
+    finally:
+        torch.set_num_threads(default_threads)
+    return results
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Print the changes against an earlier run and return the regressions found."""
+    regressions = []
+    print(f"\n{'compared to baseline':<45}{'before':>10}{'after':>10}{'change':>10}")
+    for key, old in baseline.get('benchmark', {}).items():
+        new = results.get('benchmark', {}).get(key)
+        if new is None: # configuration not part of this run
+            continue
+        change = new['throughput'] / old['throughput'] - 1
+        print(f"{key:<45}{old['throughput']:>10.1f}{new['throughput']:>10.1f}{change * 100:>+9.1f}%")
+        if change < -tolerance:
+            regressions.append(f"{key}: throughput {change * 100:+.1f}%")
+    for model_name, old in baseline.get('evaluate', {}).items():
+        new = results.get('evaluate', {}).get(model_name)
+        if not old or not new:
+            continue
+        for metric in ('accuracy', 'macro_f1'):
+            change = new[metric] - old[metric]
+            print(f"{model_name + ' ' + metric:<45}{old[metric]:>10.4f}{new[metric]:>10.4f}{change * 100:>+8.2f}pt")
+            if change < -ACCURACY_TOLERANCE:
+                regressions.append(f"{model_name}: {metric} {change * 100:+.2f} points")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Evaluate and benchmark the emotion models. Without a command, runs the full evaluation with plots.')
+    commands = parser.add_subparsers(dest='command')
     
-    print("\nClassification Report:")
-    print(classification_report(all_labels, all_preds, target_names=emotion_names, zero_division=0))
+    evaluate = commands.add_parser('evaluate', help='accuracy, per-class metrics and confusion matrices as JSON')
+    evaluate.add_argument('--models', nargs='+', choices=('facial', 'speech'), default=['facial', 'speech'])
+    evaluate.add_argument('--plot', action='store_true', help='also save confusion matrix heatmaps (needs matplotlib and seaborn)')
+    evaluate.add_argument('--per-class', type=int, default=100, help='speech files sampled per emotion')
+    evaluate.add_argument('--seed', type=int, default=0, help='seed of the speech sample')
+    evaluate.add_argument('--corpora', nargs='+', choices=('crema-d', 'ravdess', 'savee'), help='speech corpora to sample from (default: all)')
     
-    # Plot confusion matrix
-    plt.figure(figsize=(10, 8))
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Greens', xticklabels=emotion_names, yticklabels=emotion_names)
-    plt.title('Speech Emotion Recognition - Confusion Matrix')
-    plt.ylabel('True Label')
-    plt.xlabel('Predicted Label')
-    plt.tight_layout()
-    plt.savefig('speech_confusion_matrix.png')
-    print(f"\nConfusion matrix saved to speech_confusion_matrix.png")
+    benchmark = commands.add_parser('benchmark', help='inference latency and throughput')
+    benchmark.add_argument('--models', nargs='+', choices=tuple(BENCHMARK_MODELS), default=list(BENCHMARK_MODELS))
+    benchmark.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 8, 32, 128])
+    benchmark.add_argument('--threads', nargs='+', type=int, default=sorted({1, torch.get_num_threads()}), help='values for torch.set_num_threads')
+    benchmark.add_argument('--modes', nargs='+', choices=INFERENCE_MODES, default=list(INFERENCE_MODES))
+    benchmark.add_argument('--iterations', type=int, default=30, help='timed forward passes per configuration')
+    benchmark.add_argument('--warmup', type=int, default=3, help='untimed forward passes before timing')
+    benchmark.add_argument('--random-weights', action='store_true', help="don't load the trained weights")
     
-    # Calculate per-class accuracy
-    print("\nPer-Class Accuracy:")
-    for i, emotion in enumerate(emotion_names):
-        if cm[i].sum() > 0:
-            accuracy = cm[i][i] / cm[i].sum() * 100
-            print(f"{emotion}: {accuracy:.2f}%")
+    for command in (evaluate, benchmark):
+        command.add_argument('--output', help='write the results as JSON to this file, e.g. to use as a baseline later (default: stdout)')
+        command.add_argument('--baseline', help='results file of an earlier run to compare against')
+        command.add_argument('--tolerance', type=float, default=0.1, help='throughput drop (fraction) that counts as a regression')
+    return parser.parse_args()
 
-if __name__ == "__main__":
+def run_all():
     print("Starting model evaluation...")
     print("This will help identify which emotions are misclassified and why.")
     
@@ -260,3 +376,52 @@ if __name__ == "__main__":
     print("1. If accuracy is low overall: need more data augmentation and longer training")
     print("2. If specific emotions are confused: need more samples of those emotions")
     print("3. If validation accuracy was high but real-world is low: need more diverse data (in-the-wild)")
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command is None:
+        run_all()
+        sys.exit(0)
+    
+    json_to_stdout = args.output in (None, '-') # CI reads the results from stdout, the report then goes to stderr
+    with contextlib.redirect_stdout(sys.stderr if json_to_stdout else sys.stdout):
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'torch': torch.__version__,
+            'cpu_count': os.cpu_count()
+        }
+        if args.command == 'evaluate':
+            results['evaluate'] = {}
+            if 'facial' in args.models:
+                results['evaluate']['facial'] = evaluate_facial_model(plot=args.plot)
+            if 'speech' in args.models:
+                results['evaluate']['speech'] = evaluate_speech_model(args.plot, args.per_class, args.seed, args.corpora)
+                results['speech_sample'] = {'per_class': args.per_class, 'seed': args.seed, 'corpora': args.corpora or 'all'}
+        else:
+            print(f"\n{'configuration':<45}{'p50 ms':>10}{'p95 ms':>10}{'samples/s':>12}")
+            results['benchmark'] = {}
+            for name in args.models:
+                results['benchmark'].update(benchmark_model(name, args.batch_sizes, args.threads, args.modes,
+                                                            args.iterations, args.warmup, not args.random_weights))
+        
+        if not json_to_stdout:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"\nResults written to {args.output}")
+        
+        regressions = []
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            regressions = compare_to_baseline(results, baseline, args.tolerance)
+            if regressions:
+                print("\nRegressions:")
+                for regression in regressions:
+                    print(f"  {regression}")
+            else:
+                print("\nNo regressions against the baseline")
+    
+    if json_to_stdout:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,120 @@
+"""Stream a user's conversation and emotion history as NDJSON or CSV."""
+import csv
+import io
+import json
+import os
+import zlib
+from urllib.parse import quote
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from database import db, User
+from archive import iter_history
+
+EXPORT_FORMATS = ('ndjson', 'csv') # supported export formats
+EXPORT_FIELDS = ['id', 'timestamp', 'emotion', 'confidence', 'session_id', 'user_input', 'ai_response', 'drug_mentions'] # exported columns in order
+BATCH_SIZE = 500 # rows fetched from the database per round trip
+
+def iter_records(user_id, batch_size=BATCH_SIZE):
+    """Yield every record of a user, archived ones included, oldest first, without loading them all at once."""
+    app = current_app._get_current_object()
+    yield from iter_history(app, user_id, newest_first=False, batch_size=batch_size) # hot rows come in keyset batches, no lock is held between them
+
+def record_row(record):
+    """Convert a record to a list of values in EXPORT_FIELDS order."""
+    return [
+        record.id,
+        record.timestamp.isoformat() if record.timestamp else None,
+        record.emotion,
+        record.confidence,
+        record.session_id,
+        record.user_input,
+        record.ai_response,
+        bool(record.drug_mentions)
+    ]
+
+def iter_ndjson(records):
+    for record in records:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, record_row(record))), ensure_ascii=False) + '\n'
+
+def iter_csv(records):
+    buffer = io.StringIO() # reused for every line so memory stays constant
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for record in records:
+        writer.writerow(record_row(record))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue() # header only if there were no records
+
+def iter_gzip(chunks, flush_size=64 * 1024):
+    """Gzip a stream of text chunks on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31 writes a gzip header and trailer
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        pending += len(chunk)
+        if data:
+            yield data
+        if pending >= flush_size: # push compressed bytes out regularly so the client sees progress
+            yield compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+    yield compressor.flush()
+
+def export_stream(user_id, fmt='ndjson', compress=False):
+    """Return a generator producing the export for one user."""
+    records = iter_records(user_id)
+    chunks = iter_ndjson(records) if fmt == 'ndjson' else iter_csv(records)
+    if compress:
+        return iter_gzip(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
+
+def export_filename(username, fmt, compress=False):
+    """Safe file name for a user's export; usernames may contain path separators or quotes."""
+    return f"{secure_filename(username) or 'user'}_history.{fmt}" + ('.gz' if compress else '')
+
+def content_disposition(username, fmt, compress=False):
+    """Content-Disposition value with an ASCII file name and the full name as filename*."""
+    full_name = f"{username.replace('/', '_').replace(chr(92), '_')}_history.{fmt}" + ('.gz' if compress else '') # no path separators
+    return f"attachment; filename=\"{export_filename(username, fmt, compress)}\"; filename*=UTF-8''{quote(full_name, safe='')}"
+
+def export_user_to_file(app, user_id, username, out_dir, fmt='ndjson', compress=False):
+    """Write one user's export to a file inside out_dir (runs in its own app context)."""
+    path = os.path.join(out_dir, f"{user_id}_{export_filename(username, fmt, compress)}") # the id keeps sanitised names apart
+    with app.app_context():
+        with open(path, 'wb') as f:
+            for chunk in export_stream(user_id, fmt, compress):
+                f.write(chunk)
+        db.session.remove()
+    return path
+
+if __name__ == '__main__':
+    # Admin export of every user's history, one file per user
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description='Export conversation and emotion history for all users.')
+    parser.add_argument('--out-dir', default='exports', help='directory to write the export files to')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson', help='output format')
+    parser.add_argument('--gzip', action='store_true', help='gzip-compress each file')
+    parser.add_argument('--workers', type=int, default=4, help='number of users exported in parallel')
+    args = parser.parse_args()
+
+    from app import app
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    with app.app_context():
+        users = db.session.query(User.id, User.username).all()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(export_user_to_file, app, user.id, user.username, args.out_dir, args.format, args.gzip) for user in users]
+        failed = 0
+        for user, future in zip(users, futures):
+            try:
+                print(f"✓ {future.result()}")
+            except Exception as e: # one broken user must not abort everyone else's export
+                failed += 1
+                print(f"✗ user {user.id}: {e}")
+    print(f"Exported {len(users) - failed} users to {args.out_dir}" + (f", {failed} failed" if failed else ''))
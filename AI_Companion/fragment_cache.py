@@ -0,0 +1,73 @@
+"""LRU cache for rendered per-user HTML fragments, invalidated by a per-user data version read from the database."""
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+from database import db, EmotionRecord
+
+# rendered fragments keyed by (user id, fragment name), least recently used first
+class FragmentCache:
+    def __init__(self, max_entries=2000, max_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries # most fragments kept at once
+        self.max_bytes = max_bytes # most HTML characters kept at once
+        self.entries = OrderedDict() # (user_id, name) -> (version, html)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, user_id, name, version):
+        key = (user_id, name)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version: # missing or rendered from older data
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key) # most recently used goes last
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def set(self, user_id, name, html, version):
+        key = (user_id, name)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(html) > self.max_bytes: # would evict everything else, don't cache it
+                return
+            self.entries[key] = (version, html)
+            self.size += len(html)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def info(self):
+        """Hit-rate statistics."""
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats,
+                        entries=len(self.entries),
+                        bytes=self.size,
+                        hit_rate=round(self.stats['hits'] / lookups, 3) if lookups else 0.0)
+
+fragment_cache = FragmentCache() # per-process cache, the versions come from the shared database
+
+def init_fragment_cache(app):
+    """Apply the configured limits."""
+    fragment_cache.max_entries = app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 2000)
+    fragment_cache.max_bytes = app.config.get('FRAGMENT_CACHE_MAX_BYTES', 8 * 1024 * 1024)
+
+def user_data_version(user_id):
+    """Id of the user's newest record: changes with every chat, whichever worker handled it (one index lookup)."""
+    return db.session.query(EmotionRecord.id).filter_by(user_id=user_id).order_by(
+        EmotionRecord.timestamp.desc(), EmotionRecord.id.desc()).limit(1).scalar()
+
+def cached_fragment(user_id, name, render):
+    """Return the cached fragment, or call render() to build it (and its queries) on a miss."""
+    version = user_data_version(user_id) # read before rendering, so data added meanwhile makes the next view re-render
+    html = fragment_cache.get(user_id, name, version)
+    if html is None:
+        html = Markup(render())
+        fragment_cache.set(user_id, name, html, version)
+    return html
@@ -0,0 +1,134 @@
+"""Preprocess webcam frames for the facial emotion model and skip near-duplicate frames."""
+import base64
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+FACE_SIZE = 48 # input size expected by FacialExpressionCNN
+THUMB_SIZE = 16 # size of the downscaled frame used for change detection
+
+# Decode, grayscale, resize and normalise frames into reused numpy buffers
+class FramePreprocessor:
+    def __init__(self, size=FACE_SIZE):
+        self.size = size
+        self.gray = np.empty((size, size), dtype=np.uint8) # last decoded 48x48 grayscale frame
+        self.tensor = np.empty((1, 1, size, size), dtype=np.float32) # model input, reused for every frame
+
+    def decode(self, frame):
+        """Decode a JPEG data URL or raw JPEG bytes into the grayscale buffer."""
+        if isinstance(frame, str): # canvas.toDataURL() from camera.js
+            frame = base64.b64decode(frame.split(',', 1)[-1])
+        image = Image.open(io.BytesIO(frame))
+        image.draft('L', (self.size, self.size)) # let the JPEG decoder downscale and drop colour for us
+        image = image.convert('L').resize((self.size, self.size), Image.BILINEAR)
+        np.copyto(self.gray, np.asarray(image))
+        return self.gray
+
+    def normalize(self):
+        """Fill the model input buffer from the grayscale buffer (same as ToTensor + Normalize(0.5, 0.5))."""
+        out = self.tensor[0, 0]
+        np.multiply(self.gray, 1.0 / 127.5, out=out, casting='unsafe')
+        out -= 1.0
+        return self.tensor
+
+# Cheap frame-difference check on a downscaled copy of the grayscale frame
+class ChangeDetector:
+    def __init__(self, threshold=4.0, size=FACE_SIZE, thumb_size=THUMB_SIZE):
+        self.threshold = threshold # mean absolute pixel difference (0-255) that counts as a change
+        self.block = size // thumb_size
+        self.thumb = np.empty((thumb_size, thumb_size), dtype=np.float32)
+        self.previous = np.empty((thumb_size, thumb_size), dtype=np.float32)
+        self.has_previous = False
+
+    def changed(self, gray):
+        """Return True if the frame differs enough from the last frame that was run through the model."""
+        n = self.thumb.shape[0]
+        blocks = gray[:n * self.block, :n * self.block].reshape(n, self.block, n, self.block)
+        np.mean(blocks, axis=(1, 3), out=self.thumb) # block-average down to the thumbnail
+        if not self.has_previous:
+            return True
+        diff = float(np.abs(self.thumb - self.previous).mean())
+        return diff >= self.threshold
+
+    def accept(self):
+        """Remember the current thumbnail as the reference for the next comparison."""
+        self.previous, self.thumb = self.thumb, self.previous
+        self.has_previous = True
+
+    def reset(self):
+        self.has_previous = False
+
+# Full per-stream pipeline: preprocess, detect change, run the model or reuse the last prediction
+class FramePipeline:
+    def __init__(self, predict_fn, labels, threshold=4.0, decay=0.95, min_confidence=0.3, max_skip=15):
+        self.predict_fn = predict_fn # callable taking a (1, 1, 48, 48) float32 array and returning class probabilities
+        self.labels = labels # emotion names in model output order
+        self.decay = decay # confidence multiplier applied for every skipped frame
+        self.min_confidence = min_confidence # re-run the model once the reused confidence decays below this
+        self.max_skip = max_skip # re-run the model after this many skipped frames regardless
+        self.preprocessor = FramePreprocessor()
+        self.detector = ChangeDetector(threshold=threshold)
+        self.last_emotion = None
+        self.last_confidence = 0.0
+        self.skipped = 0
+        self.stats = {'frames': 0, 'inferences': 0}
+
+    def process(self, frame):
+        """Return (emotion, confidence, inferred) for a webcam frame."""
+        self.stats['frames'] += 1
+        gray = self.preprocessor.decode(frame)
+        changed = self.detector.changed(gray)
+        confidence = self.last_confidence * self.decay
+        if (not changed and self.last_emotion is not None
+                and self.skipped < self.max_skip and confidence >= self.min_confidence):
+            self.skipped += 1
+            self.last_confidence = confidence
+            return self.last_emotion, confidence, False
+
+        probabilities = np.asarray(self.predict_fn(self.preprocessor.normalize())).reshape(-1)
+        index = int(probabilities.argmax())
+        self.detector.accept()
+        self.skipped = 0
+        self.last_emotion = self.labels[index]
+        self.last_confidence = float(probabilities[index])
+        self.stats['inferences'] += 1
+        return self.last_emotion, self.last_confidence, True
+
+    def reset(self):
+        self.detector.reset()
+        self.last_emotion = None
+        self.last_confidence = 0.0
+        self.skipped = 0
+
+def torch_predictor(model):
+    """Wrap a FacialExpressionCNN so it can be used as a FramePipeline predict_fn."""
+    import torch
+
+    model.eval()
+    def predict(tensor):
+        with torch.inference_mode():
+            logits = model(torch.from_numpy(tensor)) # shares memory with the reused buffer, no copy
+            return torch.softmax(logits, dim=1).numpy()
+    return predict
+
+if __name__ == '__main__':
+    # Replay a folder of JPEG frames and report how many model calls were skipped
+    import sys
+    import os
+
+    frames_dir = sys.argv[1] if len(sys.argv) > 1 else 'frames'
+    labels = ['Anger', 'Contempt', 'Disgust', 'Fear', 'Happy', 'Sadness', 'Surprise']
+    fixed = np.full(len(labels), 0.05)
+    fixed[4] = 0.7 # stand-in for the model so only the preprocessing and skipping cost is measured
+    pipeline = FramePipeline(lambda tensor: fixed, labels)
+    start = time.perf_counter()
+    for name in sorted(os.listdir(frames_dir)):
+        if name.endswith(('.jpg', '.jpeg')):
+            with open(os.path.join(frames_dir, name), 'rb') as f:
+                pipeline.process(f.read())
+    elapsed = time.perf_counter() - start
+    frames = pipeline.stats['frames']
+    print(f"Frames: {frames}, model calls: {pipeline.stats['inferences']}, "
+          f"time per frame: {elapsed / max(frames, 1) * 1000:.2f} ms")
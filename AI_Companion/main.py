@@ -1,12 +1,19 @@
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for
-from database import db, User, Session, EmotionRecord
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, current_app
+from database import db, User, Session, EmotionRecord, canonical_emotion
+from export import EXPORT_FORMATS, export_stream, content_disposition
+from archive import recent_history, emotion_counts, user_totals
+from search import index_record, search
+from rate_limit import rate_limited
+from fragment_cache import fragment_cache, cached_fragment
+from dialogue_state import dialogue_states, current_dialogue_state
+from ai_conversation import conversation_ai as rule_based_ai
 from datetime import datetime
 import random
 
 # Responses for the AI to use based on detected emotions
 class SimpleConversationAI:
-    def generate_response(self, user_input, user_id, detected_emotion, conversation_history=None):
-        responses = {
+    def __init__(self):
+        self.responses = {
             'happy': [
                 "It's wonderful to see you feeling happy! What's bringing you joy today?",
                 "Your positive energy is contagious! Tell me more about what's making you smile.",
@@ -28,11 +35,21 @@ class SimpleConversationAI:
                 "How has your day been going? I'm interested in hearing about it."
             ]
         }
-        
-        emotion_responses = responses.get(detected_emotion.lower(), responses['neutral']) # if emotion is not recognized we assume neutral
+    
+    def templates(self):
+        # Every response text this AI can produce, used to intern responses in the database
+        return [text for options in self.responses.values() for text in options]
+    
+    def generate_response(self, user_input, user_id, detected_emotion, conversation_history=None):
+        emotion_responses = self.responses.get(detected_emotion.lower(), self.responses['neutral']) # if emotion is not recognized we assume neutral
         return random.choice(emotion_responses) # return a random response from the selected emotion category
 
-conversation_ai = SimpleConversationAI() # Initialize the AI
+conversation_ai = SimpleConversationAI() # Initialize the AI (chat answers come from rule_based_ai, its replies stay known for older records)
+
+FALLBACK_RESPONSE = "I'm here to listen. Could you tell me more about what you're experiencing?" # used when the AI fails
+
+def known_response_texts(): # every fixed response the chat can store, interned as response templates
+    return conversation_ai.templates() + rule_based_ai.templates() + [FALLBACK_RESPONSE]
 
 main_bp = Blueprint('main', __name__) # Blueprint for main routes
 
@@ -41,17 +58,21 @@ def profile(): # Display user profile and stats
     if 'user_id' not in session: # Check if user is logged in
         return redirect('/auth/login') # Redirect to login if not authenticated
     
-    user = User.query.get(session['user_id']) # Get user is from the database
+    # Reuse the rendered profile until the user's data changes
+    content_html = cached_fragment(session['user_id'], 'profile', lambda: render_profile_content(session['user_id']))
+    return render_template('profile.html', content_html=content_html)
+
+def render_profile_content(user_id): # Query the user stats and render the profile fragment
+    user = User.query.get(user_id) # Get user is from the database
     
-    # Get user stats from the data base so that we can display them on the ui
-    total_conversations = EmotionRecord.query.filter_by(user_id=user.id).count() # Number of total conversations
-    emotion_stats = db.session.query( # Emotion statistics
-        EmotionRecord.emotion, # Emotion type like happy, sad, anxious, neutral
-        db.func.count(EmotionRecord.id).label('count') # count of each emotion
-    ).filter_by(user_id=user.id).group_by(EmotionRecord.emotion).all() # Group by emotion type
+    # Get user stats from the data base so that we can display them on the ui, archived records included
+    total_conversations = user_totals(user.id)[0] # Number of total conversations
+    emotion_stats = [ # Emotion statistics like happy, sad, anxious, neutral with the count of each
+        {'emotion': emotion, 'count': count} for emotion, count in sorted(emotion_counts(user.id).items())
+    ]
     
-    # Render the profile template with user data and stats
-    return render_template('profile.html',  
+    # Render the profile fragment with user data and stats
+    return render_template('profile_content.html',  
                          username=user.username,
                          email=user.email,
                          joined_date=user.created_at,
@@ -63,12 +84,15 @@ def dashboard(): # Display user dashboard with conversation history
     if 'user_id' not in session: # check if the user id is logged in
         return redirect('/auth/login') # redirect to login if not authenticated
     
-    user = User.query.get(session['user_id']) # get user from the database
+    # Reuse the rendered dashboard until the user's data changes
+    content_html = cached_fragment(session['user_id'], 'dashboard', lambda: render_dashboard_content(session['user_id']))
+    return render_template('main.html', content_html=content_html)
+
+def render_dashboard_content(user_id): # Query the conversation history and render the dashboard fragment
+    user = User.query.get(user_id) # get user from the database
     
     # Get conversation history for the AI context
-    emotion_history = EmotionRecord.query.filter_by(
-        user_id=user.id # get emotion records for the user
-    ).order_by(EmotionRecord.timestamp.desc()).limit(10).all() # get the last 10 records
+    emotion_history = recent_history(current_app, user.id, 10) # get the last 10 records, from the archive if needed
     
     # Convert to conversation format for AI
     conversation_history = []
@@ -81,47 +105,38 @@ def dashboard(): # Display user dashboard with conversation history
                 'timestamp': record.timestamp # Timestamp of the record
             })
     
-    # render the dashboard template with the user and conversation history
-    return render_template('main.html', 
+    # render the dashboard fragment with the user and conversation history
+    return render_template('dashboard_content.html', 
                          username=user.username,
                          conversation_history=conversation_history)
 
 @main_bp.route('/api/chat', methods=['POST']) # API route for the chat
+@rate_limited('chat') # answer 429 instead of queueing writes when a client sends too fast
 def chat(): # handle chat messages
     if 'user_id' not in session: # check if user is logged in
         return jsonify({'error': 'Not authenticated'}), 401 # return error if not authenticated
     
     data = request.json # get the data from the data request
     user_input = data.get('message', '').strip() # get the user message
-    detected_emotion = data.get('emotion', 'neutral') # get the detected emotion from the user input
+    detected_emotion = canonical_emotion(data.get('emotion', 'neutral')) # get the detected emotion in its canonical spelling
     
     if not user_input: # check if the user input is empty
         return jsonify({'error': 'Empty message'}), 400 # return error if message is empty
     
-    # Get conversation history for context
-    emotion_history = EmotionRecord.query.filter_by(
-        user_id=session['user_id'] # get records for the user
-    ).order_by(EmotionRecord.timestamp.desc()).limit(10).all() # get the last 10 records
-    
-    conversation_history = [] # prepare the conversation history
-    for record in reversed(emotion_history): # oldest first
-        if record.user_input and record.ai_response: # only include records with both user and ai responses
-            conversation_history.append({ # append to the conversation history
-                'user_input': record.user_input, # user input text
-                'ai_response': record.ai_response #Ai generated response text
-            })
+    # Dialogue state of this chat session (topic, last rule, turns, emotions) instead of re-reading old messages
+    state = current_dialogue_state(session['user_id'])
     
     # Generate AI response
     try:
-        ai_response = conversation_ai.generate_response(
+        ai_response = rule_based_ai.generate_response(
             user_input=user_input,
             user_id=session['user_id'],
             detected_emotion=detected_emotion,
-            conversation_history=conversation_history
+            state=state
         )
     except Exception as e:
         print(f"AI response error: {e}")
-        ai_response = "I'm here to listen. Could you tell me more about what you're experiencing?"
+        ai_response = FALLBACK_RESPONSE
     
     # Check for drug-related content based on the keywords
     drug_keywords = ['drug', 'drugs', 'substance', 'addiction', 'addicted', 'withdrawal', 'relapse', 'pill', 'pills', 'medication', 'meds', 'cocaine', 'heroin', 'meth', 'marijuana', 'alcohol', 'drinking', 'drunk', 'high', 'stoned']
@@ -133,10 +148,14 @@ def chat(): # handle chat messages
         emotion=detected_emotion,
         user_input=user_input,
         ai_response=ai_response,
-        drug_mentions=has_drug_mention
+        drug_mentions=has_drug_mention,
+        session_id=state.session_id
     )
     
     db.session.add(emotion_record) # add the record to the session
+    db.session.flush() # assign the record id
+    index_record(emotion_record) # add the message to the search index in the same transaction
+    dialogue_states.save(state) # write the dialogue state back every few turns
     db.session.commit() # commit the session to save to the database
     
     return jsonify({ # return the ai response and detected emotion
@@ -151,9 +170,7 @@ def conversation_history(): # get the conversation history
     if 'user_id' not in session: # check if user is logged in
         return jsonify({'error': 'Not authenticated'}), 401 # return error if not authenticated
     
-    emotions = EmotionRecord.query.filter_by( # get the emotion records for the user from the database
-        user_id=session['user_id'] # filter by user id
-    ).order_by(EmotionRecord.timestamp.desc()).limit(50).all() # get the last 50 records
+    emotions = recent_history(current_app, session['user_id'], 50) # get the last 50 records, from the archive if needed
     
     # Convert to list of dicts for database response
     history = [{
@@ -167,41 +184,78 @@ def conversation_history(): # get the conversation history
     return jsonify(history) # return the history
 
 @main_bp.route('/api/user_insights') # API route for user insights
+@rate_limited('insights') # per-user and global limits
 def user_insights(): # get user insights
     if 'user_id' not in session: # check if user is logged in
         return jsonify({'error': 'Not authenticated'}), 401 # return error if not authenticated
     
     user_id = session['user_id'] # get the user id from the session
     
-    # Get emotion statistics
-    emotion_stats = db.session.query(
-        EmotionRecord.emotion,
-        db.func.count(EmotionRecord.id).label('count')
-    ).filter_by(user_id=user_id).group_by(EmotionRecord.emotion).all() # group by emotion type
-    
-    # Get recent drug mentions
-    recent_drug_mentions = EmotionRecord.query.filter_by(
-        user_id=user_id,
-        drug_mentions=True
-    ).order_by(EmotionRecord.timestamp.desc()).limit(5).all() # get the last 5 drug mention records
+    # Get emotion statistics over hot and archived records
+    emotion_stats = emotion_counts(user_id) # count per emotion type
     
     # Calculate engagement metrics
-    total_sessions = EmotionRecord.query.filter_by(user_id=user_id).count()
-    avg_session_length = db.session.query( # average length of the user messages
-        db.func.avg(db.func.length(EmotionRecord.user_input)) # average length of user input
-    ).filter_by(user_id=user_id).scalar() or 0 # scalar value or 0 if none
+    total_sessions, input_count, input_length_sum, drug_mentions = user_totals(user_id)
+    avg_session_length = input_length_sum / input_count if input_count else 0 # average length of the user messages
+    recent_drug_mentions = min(drug_mentions, 5) # at most the last 5 drug mention records
     
     # prepare insights data with emotion distribution, total interactions, average message length, recent drug mentions, and the most common emotion for the user
     insights = {
-        'emotion_distribution': {stat.emotion: stat.count for stat in emotion_stats},
+        'emotion_distribution': emotion_stats,
         'total_interactions': total_sessions,
         'avg_message_length': round(avg_session_length, 1),
-        'recent_drug_mentions': len(recent_drug_mentions),
-        'most_common_emotion': max(emotion_stats, key=lambda x: x.count).emotion if emotion_stats else 'Neutral'
+        'recent_drug_mentions': recent_drug_mentions,
+        'most_common_emotion': max(emotion_stats, key=emotion_stats.get) if emotion_stats else 'Neutral'
     }
     
     return jsonify(insights) # return the insights
 
+@main_bp.route('/api/export') # API route for exporting the full history
+def export_history(): # stream every record of the user
+    if 'user_id' not in session: # check if user is logged in
+        return jsonify({'error': 'Not authenticated'}), 401 # return error if not authenticated
+    
+    fmt = request.args.get('format', 'ndjson') # ndjson or csv
+    if fmt not in EXPORT_FORMATS: # check the requested format
+        return jsonify({'error': f"Unsupported format, use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes') # optional on-the-fly gzip
+    
+    user = User.query.get(session['user_id']) # get the user for the file name
+    mimetype = 'application/gzip' if compress else ('application/x-ndjson' if fmt == 'ndjson' else 'text/csv')
+    
+    # Stream the export so memory use does not depend on the size of the history
+    return Response(
+        stream_with_context(export_stream(user.id, fmt, compress)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': content_disposition(user.username, fmt, compress)}
+    )
+
+@main_bp.route('/api/search') # API route for searching the conversation history
+def search_history(): # ranked full-text search over the user's messages and responses
+    if 'user_id' not in session: # check if user is logged in
+        return jsonify({'error': 'Not authenticated'}), 401 # return error if not authenticated
+    
+    query = request.args.get('q', '').strip() # search text
+    if not query: # check if the query is empty
+        return jsonify({'error': 'Empty query'}), 400 # return error if there is nothing to search for
+    page = request.args.get('page', 1, type=int) # page number, starting at 1
+    per_page = request.args.get('per_page', 20, type=int) # results per page
+    
+    results, has_more = search(session['user_id'], query, page, per_page) # only this user's records are searched
+    
+    return jsonify({ # return the results with matches highlighted as **word**
+        'query': query,
+        'page': page,
+        'results': results,
+        'has_more': has_more
+    })
+
+@main_bp.route('/api/cache_stats') # API route for the fragment cache statistics
+def cache_stats(): # hit rate and size of the fragment cache
+    if 'user_id' not in session: # check if user is logged in
+        return jsonify({'error': 'Not authenticated'}), 401 # return error if not authenticated
+    return jsonify(fragment_cache.info()) # return the statistics
+
 # Add a simple home route
 @main_bp.route('/')
 def home(): # home route
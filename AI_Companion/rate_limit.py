@@ -0,0 +1,154 @@
+"""Per-user and global token-bucket rate limiting for the API routes."""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, jsonify, session
+
+BUSY_RETRY_AFTER = 1 # seconds a client waits when the shared bucket store is locked by other workers
+
+def refill(tokens, updated, now, rate, burst):
+    """Tokens in a bucket at `now`, given its state at `updated`."""
+    return min(burst, tokens + (now - updated) * rate)
+
+# buckets kept in process memory, least recently used first so idle ones are evicted cheaply
+class MemoryBucketStore:
+    def __init__(self, idle_seconds=600):
+        self.idle_seconds = idle_seconds # buckets untouched for this long are dropped
+        self.buckets = OrderedDict() # key -> (tokens, updated)
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """Take one token; return 0 if allowed, otherwise the seconds to wait."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            self.buckets[key] = (tokens - 1 if not wait else tokens, now) # most recently used goes last
+            self.evict(now)
+        return wait
+
+    def refund(self, key, burst):
+        """Give back a token taken by take()."""
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated = self.buckets[key]
+                self.buckets[key] = (min(burst, tokens + 1), updated)
+
+    def evict(self, now):
+        while self.buckets:
+            key, (tokens, updated) = next(iter(self.buckets.items()))
+            if now - updated < self.idle_seconds:
+                break
+            del self.buckets[key] # an idle bucket has refilled to burst, dropping it changes nothing
+
+# buckets kept in a local SQLite file so every worker process shares the same limits
+class SQLiteBucketStore:
+    def __init__(self, path, idle_seconds=600, evict_every=1000):
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self.evict_every = evict_every # run the idle cleanup once per this many calls
+        self.calls = 0
+        self.local = threading.local() # one connection per thread
+        connection = self.connect()
+        connection.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID')
+
+    def connect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = OFF') # losing a few bucket updates on a crash is harmless
+            self.local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst, now=None):
+        """Take one token; return 0 if allowed, otherwise the seconds to wait."""
+        now = time.time() if now is None else now # wall clock, shared between processes
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE') # serialise the read-modify-write across processes, raises when locked for too long
+        try:
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens = refill(row[0], row[1], now, rate, burst) if row else burst
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            connection.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens - 1 if not wait else tokens, now))
+            self.calls += 1
+            if self.calls % self.evict_every == 0:
+                connection.execute('DELETE FROM bucket WHERE updated < ?', (now - self.idle_seconds,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    def refund(self, key, burst):
+        """Give back a token taken by take()."""
+        self.connect().execute('UPDATE bucket SET tokens = min(?, tokens + 1) WHERE key = ?', (burst, key))
+
+# checks the per-user bucket and the global bucket of a scope
+class RateLimiter:
+    def __init__(self, store, user_rate, user_burst, global_rate, global_burst):
+        self.store = store
+        self.user_rate = user_rate # tokens per second for each user
+        self.user_burst = user_burst
+        self.global_rate = global_rate # tokens per second for everyone together
+        self.global_burst = global_burst
+
+    def check(self, scope, user_id):
+        """Return 0 if the request may go ahead, otherwise the seconds the client should wait."""
+        user_key = f'{scope}:user:{user_id}'
+        try:
+            wait = self.store.take(user_key, self.user_rate, self.user_burst)
+            if wait:
+                return wait
+            wait = self.store.take(f'{scope}:global', self.global_rate, self.global_burst) # shed load when everyone together is too busy
+            if wait:
+                self.store.refund(user_key, self.user_burst) # the user's quota isn't spent on a request that was turned away
+            return wait
+        except sqlite3.OperationalError: # shared store locked by other workers: the server is overloaded, shed this request
+            return BUSY_RETRY_AFTER
+
+def init_rate_limiter(app):
+    """Create the limiter from the config and attach it to the app."""
+    if not app.config.get('RATELIMIT_ENABLED', True):
+        return None
+    idle_seconds = app.config.get('RATELIMIT_IDLE_SECONDS', 600)
+    storage = app.config.get('RATELIMIT_STORAGE', 'memory')
+    if storage == 'memory':
+        store = MemoryBucketStore(idle_seconds)
+    else: # a file name shared by all worker processes, relative to the instance folder
+        os.makedirs(app.instance_path, exist_ok=True)
+        store = SQLiteBucketStore(os.path.join(app.instance_path, storage), idle_seconds)
+    limiter = RateLimiter(
+        store,
+        user_rate=app.config.get('RATELIMIT_USER_PER_MINUTE', 20) / 60,
+        user_burst=app.config.get('RATELIMIT_USER_BURST', 5),
+        global_rate=app.config.get('RATELIMIT_GLOBAL_PER_SECOND', 20),
+        global_burst=app.config.get('RATELIMIT_GLOBAL_BURST', 40)
+    )
+    app.extensions['rate_limiter'] = limiter
+    return limiter
+
+def rate_limited(scope):
+    """Route decorator answering 429 with Retry-After when the user or the whole app is over its limit."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            limiter = current_app.extensions.get('rate_limiter')
+            if limiter is not None and 'user_id' in session: # anonymous requests are rejected by the view anyway
+                wait = limiter.check(scope, session['user_id'])
+                if wait:
+                    retry_after = max(1, math.ceil(wait))
+                    response = jsonify({'error': 'Too many requests, please slow down', 'retry_after': retry_after})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
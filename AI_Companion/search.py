@@ -0,0 +1,142 @@
+"""Full-text search over conversation history (SQLite FTS5, LIKE fallback on other databases)."""
+import re
+
+from sqlalchemy.exc import DBAPIError
+
+from database import db, EmotionRecord, EmotionRecordText, ResponseTemplate
+
+FTS_TABLE = 'emotion_record_fts' # rowid is the EmotionRecord id
+FTS_SCHEMA = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "owner, user_input, ai_response, emotion UNINDEXED, timestamp UNINDEXED, "
+    "tokenize = 'porter unicode61')"
+)
+# owner holds a 'u<user id>' token so the user filter is answered by the index itself
+SEARCH_SQL = (
+    f"SELECT rowid, timestamp, emotion, "
+    f"snippet({FTS_TABLE}, 1, '**', '**', '…', 12), snippet({FTS_TABLE}, 2, '**', '**', '…', 12), "
+    f"bm25({FTS_TABLE}, 0.0, 2.0, 1.0) AS score "
+    f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match ORDER BY score LIMIT :limit OFFSET :offset"
+)
+INSERT_SQL = (
+    f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, owner, user_input, ai_response, emotion, timestamp) "
+    "VALUES (:id, :owner, :user_input, :ai_response, :emotion, :timestamp)"
+)
+MAX_PER_PAGE = 50 # largest page a client can ask for
+FORGET_BATCH_SIZE = 500 # record ids per DELETE when partitions expire
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+def is_sqlite():
+    return db.engine.dialect.name == 'sqlite'
+
+def owner_token(user_id):
+    return f'u{user_id}'
+
+def build_match(query, user_id):
+    """Turn free text into an FTS5 MATCH expression scoped to one user, or None if it has no words."""
+    words = WORD_PATTERN.findall(query.lower())
+    if not words:
+        return None
+    terms = ' '.join(f'"{word}"' for word in words[:-1])
+    terms = f'{terms} "{words[-1]}"*'.strip() # prefix match on the last word for search-as-you-type
+    return f'owner:{owner_token(user_id)} AND ({terms})'
+
+def index_row(record_id, user_id, user_input, ai_response, emotion, timestamp):
+    return {
+        'id': record_id,
+        'owner': owner_token(user_id),
+        'user_input': user_input or '',
+        'ai_response': ai_response or '',
+        'emotion': emotion,
+        'timestamp': timestamp.isoformat() if timestamp else None
+    }
+
+def index_record(record):
+    """Add a new EmotionRecord to the index; call after flush and before commit so both land together."""
+    if not is_sqlite():
+        return
+    try:
+        db.session.execute(db.text(INSERT_SQL), index_row(
+            record.id, record.user_id, record.user_input, record.ai_response, record.emotion, record.timestamp
+        ))
+    except DBAPIError as e: # a missing search entry must never cost the user their message
+        print(f"Search index error for record {record.id}: {e}")
+
+def forget_records(record_ids):
+    """Remove these record ids from the index (used when archive partitions expire)."""
+    if not is_sqlite():
+        return
+    record_ids = list(record_ids)
+    for start in range(0, len(record_ids), FORGET_BATCH_SIZE):
+        batch = record_ids[start:start + FORGET_BATCH_SIZE]
+        db.session.execute(db.text(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({", ".join(str(int(i)) for i in batch)})'))
+
+def init_search(app):
+    """Create the FTS table and fill it from the existing history the first time."""
+    from archive import archive_dir, list_partitions, iter_partition
+
+    with app.app_context():
+        if not is_sqlite():
+            return
+        exists = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': FTS_TABLE}).first()
+        if exists:
+            return
+        db.session.execute(db.text(FTS_SCHEMA))
+
+        # Archived records first, then the hot table with template texts resolved in SQL
+        directory = archive_dir(app)
+        for month in list_partitions(directory):
+            rows = [index_row(r.id, r.user_id, r.user_input, r.ai_response, r.emotion, r.timestamp) for r in iter_partition(directory, month)]
+            if rows:
+                db.session.execute(db.text(INSERT_SQL), rows)
+        db.session.execute(db.text(
+            f"INSERT INTO {FTS_TABLE} (rowid, owner, user_input, ai_response, emotion, timestamp) "
+            "SELECT r.id, 'u' || r.user_id, coalesce(t.user_input, ''), coalesce(rt.text, t.ai_response, ''), e.name, replace(r.timestamp, ' ', 'T') "
+            "FROM emotion_record r "
+            "JOIN emotion e ON e.id = r.emotion_id "
+            "LEFT JOIN emotion_record_text t ON t.record_id = r.id "
+            "LEFT JOIN response_template rt ON rt.id = t.ai_response_template_id"
+        ))
+        db.session.commit()
+
+def search(user_id, query, page=1, per_page=20):
+    """Return (results, has_more) for one page of ranked matches."""
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    offset = (max(page, 1) - 1) * per_page
+    if is_sqlite():
+        match = build_match(query, user_id)
+        if match is None:
+            return [], False
+        rows = db.session.execute(db.text(SEARCH_SQL), {'match': match, 'limit': per_page + 1, 'offset': offset}).all()
+        results = [{
+            'id': row[0],
+            'timestamp': row[1],
+            'emotion': row[2],
+            'user_input': row[3],
+            'ai_response': row[4],
+            'score': round(-row[5], 3) # bm25 is lower-is-better, flip it for clients
+        } for row in rows[:per_page]]
+        return results, len(rows) > per_page
+    return search_like(user_id, query, offset, per_page)
+
+def search_like(user_id, query, offset, per_page):
+    """Substring search for databases without FTS5, newest first."""
+    pattern = f'%{query}%'
+    records = EmotionRecord.query.join(EmotionRecordText).outerjoin(
+        ResponseTemplate, ResponseTemplate.id == EmotionRecordText.ai_response_template_id
+    ).filter(
+        EmotionRecord.user_id == user_id,
+        db.or_(EmotionRecordText.user_input.ilike(pattern),
+               EmotionRecordText.ai_response_text.ilike(pattern),
+               ResponseTemplate.text.ilike(pattern))
+    ).order_by(EmotionRecord.timestamp.desc()).offset(offset).limit(per_page + 1).all()
+    results = [{
+        'id': record.id,
+        'timestamp': record.timestamp.isoformat(),
+        'emotion': record.emotion,
+        'user_input': record.user_input,
+        'ai_response': record.ai_response,
+        'score': None
+    } for record in records[:per_page]]
+    return results, len(records) > per_page
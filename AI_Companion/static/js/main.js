@@ -93,6 +93,12 @@ class CompanionApp {
             // Remove typing indicator
             this.hideTypingIndicator();
 
+            // Server is rate limiting us, tell the user instead of retrying
+            if (response.status === 429) {
+                this.addMessageToChat('bot', `I need a moment to catch up. Please try again in ${data.retry_after || 1} seconds.`);
+                return;
+            }
+
             if (data.response) {
                 // Add AI response to chat
                 this.addMessageToChat('bot', data.response);